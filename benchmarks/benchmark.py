@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+########################################################################
+#
+# BookletImposer - Utility to achieve some basic imposition on PDF documents
+#
+# This program is  free software; you can redistribute  it and/or modify
+# it under the  terms of the GNU General Public  License as published by
+# the Free Software Foundation; either  version 3 of the License, or (at
+# your option) any later version.
+#
+# This program  is distributed in the  hope that it will  be useful, but
+# WITHOUT   ANY  WARRANTY;   without  even   the  implied   warranty  of
+# MERCHANTABILITY  or FITNESS  FOR A  PARTICULAR PURPOSE.   See  the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+########################################################################
+#
+# benchmark.py
+#
+# Measures the performance of pdfimposer conversions on synthetic PDF
+# documents, and compares it with a previous run.
+#
+# Usage: python benchmarks/benchmark.py [options]
+#        python benchmarks/benchmark.py --generate=FILE [options]
+#
+########################################################################
+
+import hashlib
+import json
+import multiprocessing
+import optparse
+import os
+import random
+import resource
+import sys
+import time
+import zlib
+from cStringIO import StringIO
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOPDIR, "lib"))
+
+import pdfimposer
+
+LAYOUTS = ["2x1", "2x2", "2x4", "4x4"]
+"""The layouts offered by the user interface"""
+
+CONVERSIONS = [pdfimposer.Conversion.BOOKLETIZE,
+               pdfimposer.Conversion.LINEARIZE,
+               pdfimposer.Conversion.REDUCE]
+
+FONTS = ["Helvetica", "Times-Roman", "Courier", "Helvetica-Bold",
+         "Times-Bold", "Courier-Bold"]
+
+# SYNTHETIC DOCUMENTS
+# ===================
+
+def make_pdf(stream, page_count, content_size=2000, fonts=2, images=1,
+             size=(595, 842), image_size=64):
+    """
+    Write a synthetic PDF document.
+
+    All pages share the same font and image objects, and each page has its
+    own Flate encoded content stream drawing text and images.
+
+    :Parameters:
+      - `stream` The file-like object to write the document to.
+      - `page_count` The number of pages.
+      - `content_size` The approximate size of the decoded content stream
+        of each page, in bytes.
+      - `fonts` The number of fonts used by each page.
+      - `images` The number of images drawn on each page.
+      - `size` A tuple (width, height) representing the page size.
+      - `image_size` The width and height of the images in pixels. Images
+        larger than 64 pixels are filled with noise, so that they do not
+        compress.
+    """
+    width, height = size
+    objects = [None, None]      # The catalog and the page tree
+    def add_object(data):
+        objects.append(data)
+        return len(objects)
+
+    def stream_object(data, dictionary=""):
+        data = zlib.compress(data)
+        return "<< /Length %i /Filter /FlateDecode %s>>\nstream\n%s\n" \
+               "endstream" % (len(data), dictionary, data)
+
+    resources = []
+    if fonts:
+        resources.append("/Font << %s >>" % " ".join([
+            "/F%i %i 0 R" % (font, add_object(
+                "<< /Type /Font /Subtype /Type1 /BaseFont /%s >>" %
+                FONTS[font % len(FONTS)]))
+            for font in range(fonts)]))
+    if images:
+        if image_size > 64:
+            generator = random.Random(image_size)
+            pixels = "".join([chr(generator.getrandbits(8))
+                              for pixel in range(image_size * image_size)])
+        else:
+            pixels = "".join([chr((x ^ y) & 0xff) for y in range(image_size)
+                              for x in range(image_size)])
+        resources.append("/XObject << %s >>" % " ".join([
+            "/Im%i %i 0 R" % (image, add_object(stream_object(pixels,
+                "/Type /XObject /Subtype /Image /Width %i /Height %i "
+                "/ColorSpace /DeviceGray /BitsPerComponent 8 " %
+                (image_size, image_size))))
+            for image in range(images)]))
+    resources.append("/ProcSet [/PDF /Text /ImageB]")
+    resources = "<< %s >>" % " ".join(resources)
+
+    kids = []
+    for page in range(page_count):
+        operations = ["0 0 1 RG 10 10 %i %i re S" % (width - 20, height - 20)]
+        line = 0
+        while sum([len(operation) + 1 for operation in operations]) \
+                < content_size:
+            y = height - 40 - (line * 20) % (height - 80)
+            if images and line % 10 == 9:
+                operations.append("q 64 0 0 64 %i %i cm /Im%i Do Q" % (
+                    width - 100, y, line % images))
+            elif fonts:
+                operations.append("BT /F%i 12 Tf 40 %i Td (Page %i line %i) "
+                                  "Tj ET" % (line % fonts, y, page + 1, line))
+            else:
+                operations.append("40 %i 200 10 re f" % y)
+            line += 1
+        contents = add_object(stream_object("\n".join(operations)))
+        kids.append(add_object(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %i %i] "
+            "/Resources %s /Contents %i 0 R >>" % (width, height, resources,
+                                                  contents)))
+    objects[0] = "<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = "<< /Type /Pages /Kids [%s] /Count %i >>" % (
+        " ".join(["%i 0 R" % kid for kid in kids]), page_count)
+
+    position = 0
+    offsets = []
+    for data in ["%PDF-1.4\n"] + ["%i 0 obj\n%s\nendobj\n" % (number + 1, data)
+                                  for number, data in enumerate(objects)]:
+        offsets.append(position)
+        stream.write(data)
+        position += len(data)
+    stream.write("xref\n0 %i\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets[1:]:
+        stream.write("%010i 00000 n \n" % offset)
+    stream.write("trailer\n<< /Size %i /Root 1 0 R >>\nstartxref\n%i\n"
+                 "%%%%EOF\n" % (len(objects) + 1, position))
+
+# MEASUREMENTS
+# ============
+
+class ByteCounter(object):
+    """A file-like object counting and hashing the bytes written to it."""
+    def __init__(self):
+        self.size = 0
+        self.digest = hashlib.md5()
+
+    def write(self, data):
+        self.size += len(data)
+        self.digest.update(data)
+
+def run_case(case):
+    """
+    Run one conversion and measure it.
+
+    This is run in a new process for each case, so that the peak memory
+    usage only accounts for that case. The peak memory usage of the worker
+    processes building output pages is measured separately: it is the one
+    of the largest worker, as reported by the system once they have ended.
+
+    :Parameters:
+      - `case` A tuple (input_data, conversion, layout, copy_pages,
+        placement_engine, jobs, compression_threads). If
+        compression_threads is None, the default number of threads is used.
+
+    :Returns:
+        A dictionnary containing the measurements, or the error if the
+        conversion is impossible.
+    """
+    (input_data, conversion, layout, copy_pages, placement_engine, jobs,
+     compression_threads) = case
+    output = ByteCounter()
+    converter = pdfimposer.StreamConverter(StringIO(input_data), output,
+                                           layout, "A4", copy_pages,
+                                           placement_engine, jobs)
+    converter.set_progress_callback(lambda message, progress: None)
+    if compression_threads is not None:
+        converter.set_compression_threads(compression_threads)
+    start = time.time()
+    try:
+        converter.impose(converter.get_plan(conversion))
+    except pdfimposer.PdfConvError, e:
+        return {"error": str(e)}
+    wall_time = time.time() - start
+    return {
+        "wall_time": wall_time,
+        "pages_per_second": converter.get_page_count() / wall_time,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_worker_rss_kb":
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        "output_size": output.size,
+        "output_digest": output.digest.hexdigest(),
+        }
+
+def run_case_process(case):
+    """
+    Run one conversion in a new process (see run_case).
+
+    The process is not a daemon, so that the conversion can start its own
+    worker processes.
+    """
+    receiver, sender = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(
+        target=lambda: sender.send(run_case(case)))
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+def run_benchmark(options):
+    """
+    Run all the cases selected by the command line options.
+
+    With the check option, each case is also run with a single job and a
+    single compression thread, and the outputs must be identical.
+
+    :Returns:
+        A dictionnary with the settings and the measurements of each case,
+        keyed by case name, and the names of the cases whose output differs
+        from the checked one.
+    """
+    inputs = {}
+    for orientation, size in (("portrait", (595, 842)),
+                              ("landscape", (842, 595))):
+        data = StringIO()
+        make_pdf(data, options.pages, options.content_size, options.fonts,
+                 options.images, size)
+        inputs[orientation] = data.getvalue()
+
+    results = {}
+    mismatches = []
+    for conversion in options.conversions.split(","):
+        for layout in options.layouts.split(","):
+            for copy_pages in (False, True):
+                name = "%s %s%s" % (conversion, layout,
+                                    copy_pages and " copy" or "")
+                # The input orientation which suits the layout is used
+                for orientation in ("portrait", "landscape"):
+                    result = run_case_process((
+                        inputs[orientation], conversion, layout,
+                        copy_pages, options.engine, options.jobs,
+                        options.compression_threads))
+                    if "error" not in result:
+                        break
+                if "error" in result:
+                    print "%-24s %s" % (name, result["error"])
+                    continue
+                result["input"] = orientation
+                results[name] = result
+                print "%-24s %8.3f s %9.1f pages/s %8i KB %8i KB %10i " \
+                    "bytes" % (name, result["wall_time"],
+                               result["pages_per_second"],
+                               result["peak_rss_kb"],
+                               result["peak_worker_rss_kb"],
+                               result["output_size"])
+                if options.check:
+                    reference = run_case_process((
+                        inputs[orientation], conversion, layout,
+                        copy_pages, options.engine, 1, 1))
+                    if reference["output_digest"] != \
+                            result["output_digest"]:
+                        mismatches.append(name)
+
+    return {
+        "settings": {
+            "pages": options.pages,
+            "content_size": options.content_size,
+            "fonts": options.fonts,
+            "images": options.images,
+            "engine": options.engine,
+            "jobs": options.jobs,
+            "compression_threads": options.compression_threads,
+            },
+        "cases": results,
+        "mismatches": mismatches,
+        }
+
+def compare(results, baseline, threshold):
+    """
+    Compare the results of a run with a baseline.
+
+    :Parameters:
+      - `results` The results of this run (see run_benchmark).
+      - `baseline` The results of a previous run.
+      - `threshold` The relative increase of wall time, peak memory usage
+        or output size considered a regression (e.g. 0.1 for 10%).
+
+    :Returns:
+        A list of messages describing the regressions.
+    """
+    regressions = []
+    if results["settings"] != baseline["settings"]:
+        print "WARNING: the baseline was run with other settings: %s" % \
+            baseline["settings"]
+    for name in sorted(results["cases"].keys()):
+        if name not in baseline["cases"]:
+            continue
+        for key in ("wall_time", "peak_rss_kb", "peak_worker_rss_kb",
+                    "output_size"):
+            if key not in baseline["cases"][name]:
+                continue
+            old = baseline["cases"][name][key]
+            new = results["cases"][name][key]
+            if old and float(new - old) / old > threshold:
+                regressions.append("%s: %s %s -> %s (%+.0f%%)" % (
+                    name, key, old, new, float(new - old) / old * 100))
+    return regressions
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--pages", type="int", default=100,
+        help="number of pages of the input documents (default 100)")
+    parser.add_option("--content-size", type="int", default=2000,
+        help="size of each page content stream in bytes (default 2000)")
+    parser.add_option("--fonts", type="int", default=2,
+        help="number of fonts shared by all pages (default 2)")
+    parser.add_option("--images", type="int", default=1,
+        help="number of images shared by all pages (default 1)")
+    parser.add_option("--layouts", default=",".join(LAYOUTS),
+        help="comma separated layouts (default %default)")
+    parser.add_option("--conversions", default=",".join(CONVERSIONS),
+        help="comma separated conversions (default %default)")
+    parser.add_option("--engine", default=pdfimposer.PlacementEngine.MERGE,
+        help="placement engine (default %default)")
+    parser.add_option("-j", "--jobs", type="int", default=1,
+        help="number of processes building output pages (default 1)")
+    parser.add_option("--compression-threads", type="int",
+        help="number of threads compressing output pages (default: number "
+             "of processors)")
+    parser.add_option("-c", "--check", action="store_true", default=False,
+        help="check that the outputs do not depend on the number of jobs "
+             "and compression threads")
+    parser.add_option("-o", "--output",
+        help="save the results as JSON to OUTPUT")
+    parser.add_option("-b", "--baseline",
+        help="compare the results with the JSON file BASELINE")
+    parser.add_option("-t", "--threshold", type="float", default=0.1,
+        help="relative increase considered a regression (default 0.1)")
+    parser.add_option("--generate", metavar="FILE",
+        help="only write a synthetic input document to FILE")
+    options, args = parser.parse_args()
+
+    if options.generate:
+        output = open(options.generate, "wb")
+        make_pdf(output, options.pages, options.content_size,
+                 options.fonts, options.images)
+        output.close()
+        return 0
+
+    results = run_benchmark(options)
+    for name in results["mismatches"]:
+        print "MISMATCH: %s: the output depends on the number of jobs or " \
+            "compression threads" % name
+    if options.output:
+        output = open(options.output, "w")
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.close()
+    if options.baseline:
+        regressions = compare(results, json.load(open(options.baseline)),
+                              options.threshold)
+        for regression in regressions:
+            print "REGRESSION: %s" % regression
+        if regressions:
+            return 1
+    if results["mismatches"]:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+########################################################################
+#
+# BookletImposer - Utility to achieve some basic imposition on PDF documents
+#
+# This program is  free software; you can redistribute  it and/or modify
+# it under the  terms of the GNU General Public  License as published by
+# the Free Software Foundation; either  version 3 of the License, or (at
+# your option) any later version.
+#
+# This program  is distributed in the  hope that it will  be useful, but
+# WITHOUT   ANY  WARRANTY;   without  even   the  implied   warranty  of
+# MERCHANTABILITY  or FITNESS  FOR A  PARTICULAR PURPOSE.   See  the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+########################################################################
+#
+# input.py
+#
+# Compares reading the input file through a file object and through a
+# memory map (FileConverter map_input option), on a large synthetic PDF
+# file with big images, or on given PDF files.
+#
+# Usage: python benchmarks/input.py [options] [FILE...]
+#
+########################################################################
+
+import multiprocessing
+import optparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOPDIR, "lib"))
+
+import pdfimposer
+from benchmark import make_pdf
+
+def run_case(connection, infile_name, map_input, engine, jobs):
+    """
+    Convert a file and send the measurements through a connection.
+
+    This is run in a new process for each case, so that the peak memory
+    usage only accounts for that case.
+    """
+    descriptor, outfile_name = tempfile.mkstemp(".pdf")
+    os.close(descriptor)
+    start = time.time()
+    converter = pdfimposer.FileConverter(infile_name, outfile_name, "2x2",
+                                         "A4", False, None, engine, jobs,
+                                         map_input)
+    converter.set_progress_callback(lambda message, progress: None)
+    converter.reduce()
+    converter.close()
+    connection.send({
+        "wall_time": time.time() - start,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+    os.remove(outfile_name)
+
+def measure(infile_name, map_input, engine, jobs, runs):
+    """
+    Run a case several times.
+
+    :Returns:
+        The best wall time and peak memory usage of the runs.
+    """
+    results = []
+    for run in range(runs):
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=run_case, args=(
+            child, infile_name, map_input, engine, jobs))
+        process.start()
+        results.append(parent.recv())
+        process.join()
+    return (min([result["wall_time"] for result in results]),
+            min([result["peak_rss_kb"] for result in results]))
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [FILE...]")
+    parser.add_option("--pages", type="int", default=200,
+        help="number of pages of the synthetic document (default 200)")
+    parser.add_option("--images", type="int", default=16,
+        help="number of images of the synthetic document (default 16)")
+    parser.add_option("--image-size", type="int", default=1500,
+        help="width and height of the images in pixels (default 1500)")
+    parser.add_option("--engines", default=",".join([
+            pdfimposer.PlacementEngine.MERGE,
+            pdfimposer.PlacementEngine.XOBJECT]),
+        help="comma separated placement engines (default %default)")
+    parser.add_option("-j", "--jobs", type="int", default=2,
+        help="number of processes building output pages in the second "
+             "run of each engine (default 2)")
+    parser.add_option("--runs", type="int", default=3,
+        help="number of runs of each case, the best one is kept "
+             "(default 3)")
+    options, infile_names = parser.parse_args()
+
+    synthetic = None
+    if not infile_names:
+        descriptor, synthetic = tempfile.mkstemp(".pdf")
+        output = os.fdopen(descriptor, "wb")
+        make_pdf(output, options.pages, images=options.images,
+                 image_size=options.image_size)
+        output.close()
+        infile_names = [synthetic]
+
+    try:
+        for infile_name in infile_names:
+            print "%s: %.1f MB" % (infile_name,
+                                   os.path.getsize(infile_name) / 1048576.)
+            for engine in options.engines.split(","):
+                for jobs in sorted(set([1, options.jobs])):
+                    for map_input in (False, True):
+                        wall_time, peak_rss = measure(infile_name, map_input,
+                                                      engine, jobs,
+                                                      options.runs)
+                        print "  %-10s jobs %i %-4s %8.3f s %8i KB" % (
+                            engine, jobs, map_input and "mmap" or "file",
+                            wall_time, peak_rss)
+    finally:
+        if synthetic:
+            os.remove(synthetic)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
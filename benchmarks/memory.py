@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+########################################################################
+#
+# BookletImposer - Utility to achieve some basic imposition on PDF documents
+#
+# This program is  free software; you can redistribute  it and/or modify
+# it under the  terms of the GNU General Public  License as published by
+# the Free Software Foundation; either  version 3 of the License, or (at
+# your option) any later version.
+#
+# This program  is distributed in the  hope that it will  be useful, but
+# WITHOUT   ANY  WARRANTY;   without  even   the  implied   warranty  of
+# MERCHANTABILITY  or FITNESS  FOR A  PARTICULAR PURPOSE.   See  the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+########################################################################
+#
+# memory.py
+#
+# Checks that the memory used by a conversion does not grow with the
+# size of the document, by converting synthetic documents of two sizes
+# with each placement engine.
+#
+# Usage: python benchmarks/memory.py [options]
+#
+########################################################################
+
+import multiprocessing
+import optparse
+import os
+import resource
+import sys
+from cStringIO import StringIO
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOPDIR, "lib"))
+
+import pdfimposer
+from benchmark import make_pdf, ByteCounter
+
+def run_case(connection, pages, content_size, engine):
+    """
+    Convert a synthetic document and send the growth of the peak memory
+    usage during the conversion through a connection, in kilobytes.
+
+    This is run in a new process for each case, so that the peak memory
+    usage only accounts for that case. The input document and the plan
+    are built before the measurement starts.
+    """
+    input_data = StringIO()
+    make_pdf(input_data, pages, content_size)
+    converter = pdfimposer.StreamConverter(input_data, ByteCounter(), "2x1",
+                                           "A4", False, engine, 1)
+    converter.set_progress_callback(lambda message, progress: None)
+    plan = converter.get_plan(pdfimposer.Conversion.BOOKLETIZE)
+    start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    converter.impose(plan)
+    connection.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+                    start)
+
+def measure(pages, content_size, engine):
+    """
+    Run a case in a new process.
+
+    :Returns:
+        The growth of the peak memory usage during the conversion, in
+        kilobytes.
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=run_case, args=(
+        child, pages, content_size, engine))
+    process.start()
+    growth = parent.recv()
+    process.join()
+    return growth
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--pages", default="200,800",
+        help="comma separated numbers of pages of the small and the large "
+             "document (default %default)")
+    parser.add_option("--content-size", type="int", default=20000,
+        help="size of each page content stream in bytes (default 20000)")
+    parser.add_option("--engines", default=",".join([
+            pdfimposer.PlacementEngine.MERGE,
+            pdfimposer.PlacementEngine.XOBJECT,
+            pdfimposer.PlacementEngine.FAST_MERGE]),
+        help="comma separated placement engines (default %default)")
+    parser.add_option("-t", "--threshold", type="int", default=4096,
+        help="increase of the memory growth between the small and the "
+             "large document considered a regression, in KB (default 4096)")
+    options, args = parser.parse_args()
+
+    small, large = [int(pages) for pages in options.pages.split(",")]
+    regressions = []
+    for engine in options.engines.split(","):
+        small_growth = measure(small, options.content_size, engine)
+        large_growth = measure(large, options.content_size, engine)
+        print "%-10s %5i pages %8i KB %5i pages %8i KB" % (
+            engine, small, small_growth, large, large_growth)
+        if large_growth - small_growth > options.threshold:
+            regressions.append("%s: %i KB -> %i KB" % (
+                engine, small_growth, large_growth))
+    for regression in regressions:
+        print "REGRESSION: %s" % regression
+    if regressions:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
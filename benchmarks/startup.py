@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+########################################################################
+#
+# BookletImposer - Utility to achieve some basic imposition on PDF documents
+#
+# This program is  free software; you can redistribute  it and/or modify
+# it under the  terms of the GNU General Public  License as published by
+# the Free Software Foundation; either  version 3 of the License, or (at
+# your option) any later version.
+#
+# This program  is distributed in the  hope that it will  be useful, but
+# WITHOUT   ANY  WARRANTY;   without  even   the  implied   warranty  of
+# MERCHANTABILITY  or FITNESS  FOR A  PARTICULAR PURPOSE.   See  the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+########################################################################
+
+########################################################################
+#
+# startup.py
+#
+# Measures the time bookletimposer takes to start in automatic mode
+# (--no-gui), and checks that the GTK+ modules are not loaded then.
+#
+# Usage: python benchmarks/startup.py [RUNS]
+#
+########################################################################
+
+import os
+import subprocess
+import sys
+import time
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(TOPDIR, "bin", "bookletimposer")
+
+# Runs bookletimposer in automatic mode without input file, which only
+# prints an error, and lists the GUI modules that were loaded meanwhile
+LIST_MODULES = """
+import sys
+sys.argv = [%r, "--no-gui"]
+try:
+    execfile(%r, {"__name__": "__main__"})
+except SystemExit:
+    pass
+print "GUI modules:", " ".join(sorted([name for name in sys.modules
+                       if name.split(".")[0] in ("gi", "gtk", "gobject")
+                       or name == "bookletimposer.gui"]))
+""" % (SCRIPT, SCRIPT)
+
+def time_command(command, runs):
+    """
+    Run a command several times.
+
+    :Returns:
+        The list of the durations of the runs, in seconds.
+    """
+    devnull = open(os.devnull, "w")
+    durations = []
+    for run in range(runs):
+        start = time.time()
+        subprocess.call(command, cwd=TOPDIR, stdout=devnull, stderr=devnull)
+        durations.append(time.time() - start)
+    devnull.close()
+    return durations
+
+def report(name, durations):
+    durations = sorted(durations)
+    print "%-24s min %7.1f ms  median %7.1f ms" % (
+        name, durations[0] * 1000, durations[len(durations) / 2] * 1000)
+
+def main():
+    if len(sys.argv) > 1:
+        runs = int(sys.argv[1])
+    else:
+        runs = 20
+
+    interpreter = time_command([sys.executable, "-c", "pass"], runs)
+    startup = time_command([sys.executable, SCRIPT, "--no-gui"], runs)
+    report("python", interpreter)
+    report("bookletimposer --no-gui", startup)
+    print "%-24s median %7.1f ms" % ("difference", (
+        sorted(startup)[runs / 2] - sorted(interpreter)[runs / 2]) * 1000)
+
+    modules = subprocess.Popen([sys.executable, "-c", LIST_MODULES],
+                               cwd=TOPDIR, stdout=subprocess.PIPE,
+                               stderr=open(os.devnull, "w")).communicate()[0]
+    for line in modules.splitlines():
+        if line.startswith("GUI modules:"):
+            modules = line.split()[2:]
+            break
+    else:
+        print "bookletimposer --no-gui failed to start"
+        return 1
+    if modules:
+        print "GUI modules loaded: %s" % " ".join(modules)
+        return 1
+    print "GUI modules loaded: none"
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
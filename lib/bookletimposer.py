@@ -33,23 +33,97 @@
 ########################################################################
 
 import optparse
-import gettext
+import json
+import glob
+import time
+import sys
 
 if __debug__:
-    import sys
     import os
     sys.path.insert(0, os.path.join(os.getcwd(), "lib"))
 
 import pdfimposer # We need its exceptions
 
-import bookletimposer.gui as gui
+# The user interface is only imported when it is shown, so that automatic
+# conversions do not need GTK+
 import bookletimposer.backend as backend
 import bookletimposer.config as config
 
-gettext.install("bookletimposer", localedir=config.get_localedir(), unicode=True)
+config.install_gettext()
 
 __version__ = "0.2"
 
+def convert_batch(preferences, infiles, jobs, overwrite):
+    """
+    Convert several files and print a summary.
+
+    :Returns:
+        0 if all files were converted or skipped, 1 otherwise.
+    """
+    start = time.time()
+    n_converted = 0
+    n_pages = 0
+    skipped = []
+    failures = []
+    for result in backend.convert_batch(preferences, infiles, jobs, overwrite):
+        if result.error:
+            print(_("FAILED: %s") % result.infile_name)
+            failures.append(result)
+        elif result.skipped:
+            print(_("skipped: %s (%s exists)") % (result.infile_name,
+                                                 result.outfile_name))
+            skipped.append(result)
+        else:
+            print(_("converted: %s -> %s") % (result.infile_name,
+                                              result.outfile_name))
+            n_converted += 1
+            n_pages += result.page_count
+    duration = max(time.time() - start, 1e-6)
+
+    print(_("%i files converted (%i pages), %i skipped, %i failed in %.2f s") %
+          (n_converted, n_pages, len(skipped), len(failures), duration))
+    print(_("throughput: %.2f files/s, %.2f pages/s") %
+          (n_converted / duration, n_pages / duration))
+    for result in failures:
+        print(_("ERROR: %s: %s") % (result.infile_name, result.error))
+    if failures:
+        return 1
+    return 0
+
+def parse_range(text):
+    """
+    Parse a range of pages given on the command line.
+
+    :Parameters:
+      - `text` A string in the format FIRST-LAST or N, pages being numbered
+        from 1.
+
+    :Returns:
+        A tuple (first, last) of page numbers starting from 0.
+
+    :Raises ValueError: if the text is not a valid range.
+    """
+    bounds = text.split("-")
+    if len(bounds) == 1:
+        bounds = bounds * 2
+    if len(bounds) != 2:
+        raise ValueError(text)
+    first, last = int(bounds[0]), int(bounds[1])
+    if not 1 <= first <= last:
+        raise ValueError(text)
+    return first - 1, last - 1
+
+def print_stats(stats):
+    """
+    Print the timers and counters of a conversion (see
+    pdfimposer.StreamConverter.get_stats).
+    """
+    for key in sorted(stats.keys()):
+        if key.startswith("time_"):
+            print("%-18s %10.3f s" % (key, stats[key]))
+        else:
+            print("%-18s %10i" % (key, stats[key]))
+
 def main():
     """
     This is the function that launches the program
@@ -58,7 +132,7 @@ def main():
     infile = None
     
     parser = optparse.OptionParser(
-        usage="%prog [options] [infile]",
+        usage="%prog [options] [infile...]",
         version="%prog " + __version__)
     parser.add_option ("-o", "--output", dest="outfile",
         help=_("output PDF file"))
@@ -98,11 +172,61 @@ def main():
         action="store_false", dest="overwrite",
         default=True,
         help=_("do not overwrite output file if it exists"))
+    parser.add_option ("-j", "--jobs",
+        type="int", dest="jobs",
+        default=1,
+        help=_("number of processes used to build output pages, or to convert files at the same time if there are several input files"))
+    parser.add_option ("--stats",
+        action="store_true", dest="stats",
+        default=False,
+        help=_("print the time spent in each conversion phase and some counters (implies --no-gui)"))
+    parser.add_option ("-d", "--dry-run",
+        action="store_true", dest="dry_run",
+        default=False,
+        help=_("print the placement of input pages on output pages as JSON, without converting (implies --no-gui)"))
+    parser.add_option ("-z", "--compression",
+        type="choice", dest="compression",
+        choices=[pdfimposer.CompressionProfile.NONE,
+                 pdfimposer.CompressionProfile.FAST,
+                 pdfimposer.CompressionProfile.DEFAULT,
+                 pdfimposer.CompressionProfile.MAX],
+        default=None,
+        help=_("compression of the output pages: none, fast, default or max"))
+    parser.add_option ("--mmap",
+        action="store_true", dest="map_input",
+        default=False,
+        help=_("map input files in memory instead of reading them, which may be faster on network filesystems"))
+    parser.add_option ("--cache",
+        dest="cache_dir", metavar="DIR",
+        default=None,
+        help=_("reuse the results of previous identical conversions stored in DIR, and store new results there"))
+    parser.add_option ("--cache-size",
+        type="int", dest="cache_size", metavar="MB",
+        default=256,
+        help=_("maximum size of the cache in megabytes (default 256); the least recently used results are removed first"))
+    parser.add_option ("--page-range",
+        dest="page_range", metavar="FIRST-LAST",
+        default=None,
+        help=_("only convert input pages FIRST to LAST, as if the document only contained them"))
+    parser.add_option ("--sheet-range",
+        dest="sheet_range", metavar="FIRST-LAST",
+        default=None,
+        help=_("only build output pages FIRST to LAST, e.g. to print a proof of the first sheets"))
     
     (options, args) = parser.parse_args()
+    if options.jobs < 1:
+        parser.error(_("the number of jobs must be at least 1"))
     
-    if len(args) >= 1:
-        infile = args[0]
+    # Patterns are expanded here too, as they may not have been by the shell
+    infiles = []
+    for arg in args:
+        matches = glob.glob(arg)
+        if matches:
+            infiles.extend(sorted(matches))
+        else:
+            infiles.append(arg)
+    if len(infiles) == 1:
+        infile = infiles[0]
     
     preferences = backend.ConverterPreferences()
         
@@ -118,25 +242,72 @@ def main():
         preferences.layout = options.pages_per_sheet
     if options.copy_pages:
         preferences.copy_pages = True
+    if options.jobs:
+        preferences.jobs = options.jobs
+    if options.compression:
+        preferences.compression = options.compression
+    if options.map_input:
+        preferences.map_input = True
+    if options.cache_dir:
+        preferences.cache = pdfimposer.ResultCache(options.cache_dir,
+                                                   options.cache_size * 1024 * 1024)
+    for name in ("page_range", "sheet_range"):
+        if getattr(options, name):
+            try:
+                setattr(preferences, name, parse_range(getattr(options, name)))
+            except ValueError:
+                print _("ERROR: Invalid range: %s") % getattr(options, name)
+                return 1
     
-    if options.gui:
+    if len(infiles) > 1:
+        if options.outfile:
+            print _("ERROR: An output file can not be given with several input files.")
+            return 1
+        if options.dry_run:
+            print _("ERROR: In dry run mode, only one file can be processed.")
+            return 1
+        return convert_batch(preferences, infiles, options.jobs,
+                             options.overwrite)
+    elif options.dry_run:
+        if not preferences.infile_name:
+            print _("ERROR: In dry run mode, you must provide a file to process.")
+            return 1
+        try:
+            with preferences.create_converter() as converter:
+                print json.dumps(converter.plan(), indent=2, sort_keys=True)
+        except pdfimposer.PdfConvError, e:
+            print _("ERROR: %s") % e
+            return 1
+    elif options.gui and not options.stats:
+        import bookletimposer.gui as gui
         ui = gui.BookletImposerUI(preferences)
         gui.Gtk.main()
     else:
         if not preferences.infile_name:
             print _("ERROR: In automatic mode, you must provide a file to process.")
-            return
+            return 1
         def overwrite_callback(filename):
             return options.overwrite
         try:
             converter = preferences.create_converter(overwrite_callback)
         except pdfimposer.UserInterruptError:
             return
+        except pdfimposer.PdfConvError, e:
+            print _("ERROR: %s") % e
+            return 1
         def progress_callback(message, progress):
             print(_("%i%%: %s") % (progress*100, message))
-        converter.set_progress_callback(progress_callback)
-        converter.run()
+        with converter:
+            converter.set_progress_callback(progress_callback)
+            converter.set_collect_stats(options.stats)
+            try:
+                converter.run()
+            except pdfimposer.PdfConvError, e:
+                print _("ERROR: %s") % e
+                return 1
+        if options.stats:
+            print_stats(converter.get_stats())
     return 0 
     
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
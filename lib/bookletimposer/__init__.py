@@ -29,10 +29,9 @@
 #
 ########################################################################
 
-import gettext
-import locale
+# Only what the command line conversions need is loaded here: the GTK+
+# user interface is set up when bookletimposer.gui is imported.
+
 import config
 
-locale.setlocale(locale.LC_ALL, '')
-locale.bindtextdomain("bookletimposer", config.get_localedir())
-gettext.install("bookletimposer", localedir=config.get_localedir(), unicode=True)
+config.install_gettext()
@@ -31,8 +31,13 @@
 ########################################################################
 
 import pdfimposer
+import os
 import os.path
 import re
+import copy
+import errno
+import multiprocessing
+import signal
 
 class BookletImposerError(pdfimposer.PdfConvError):
     """The base class for all exceptions raised by BookletImposer.
@@ -56,6 +61,80 @@ class ConversionType:
     REDUCE = 3
     """The conversion from multiple input pages to one output page"""
 
+CONVERSIONS = {
+    ConversionType.BOOKLETIZE: pdfimposer.Conversion.BOOKLETIZE,
+    ConversionType.LINEARIZE: pdfimposer.Conversion.LINEARIZE,
+    ConversionType.REDUCE: pdfimposer.Conversion.REDUCE,
+    }
+"""The pdfimposer.Conversion performed for each ConversionType"""
+
+class DocumentAnalysis(object):
+    """The characteristics of an input file, read once when it is chosen.
+
+    The attributes are:
+      - `infile_name`: the name of the input PDF file;
+      - `page_count`: the number of pages;
+      - `page_geometry`: the pdfimposer.PageGeometry of the pages, which
+        converters of the same file reuse instead of reading it again.
+    """
+    def __init__(self, infile_name):
+        """Read the pages of a file.
+
+        :Parameters:
+          - `infile_name`: The name of the input PDF file.
+        """
+        self.infile_name = infile_name
+        self.__stamp = self.__get_stamp(infile_name)
+        with open(infile_name, "rb") as input_stream:
+            converter = pdfimposer.StreamConverter(input_stream, None)
+            self.page_geometry = converter.get_page_geometry()
+        self.page_count = len(self.page_geometry)
+
+    @staticmethod
+    def __get_stamp(infile_name):
+        """Get the size and modification time of a file."""
+        stat = os.stat(infile_name)
+        return stat.st_size, stat.st_mtime
+
+    def is_current(self, infile_name):
+        """Get wether the analysis describes a file as it is now.
+
+        :Parameters:
+          - `infile_name`: The name of the input PDF file.
+
+        :Returns:
+            False if the analysis is about another file, or if the file
+            changed since it was analysed.
+        """
+        try:
+            return infile_name == self.infile_name and \
+                self.__get_stamp(infile_name) == self.__stamp
+        except OSError:
+            return False
+
+    def __str__(self):
+        width, height = self.page_geometry.get_size(0)
+        return _("%i pages of %i x %i pt") % (self.page_count, width, height)
+
+def analyze_document(infile_name):
+    """Analyse an input file.
+
+    No exception is raised: errors are reported in the result, so that
+    this can be run in a process pool.
+
+    :Parameters:
+      - `infile_name`: The name of the input PDF file.
+
+    :Returns:
+        A tuple (infile_name, analysis, error) where analysis is a
+        DocumentAnalysis, or None and error is a message explaining why the
+        file could not be read.
+    """
+    try:
+        return infile_name, DocumentAnalysis(infile_name), None
+    except Exception, e:
+        return infile_name, None, "%s: %s" % (e.__class__.__name__, e)
+
 class ConverterPreferences(object):
     def __init__(self):
         self._infile_name = None
@@ -65,6 +144,13 @@ class ConverterPreferences(object):
         self.paper_format = None
         self.paper_orientation = None
         self.outfile_name = None
+        self.jobs = 1
+        self.cache = None
+        self.map_input = False
+        self.compression = None
+        self.analysis = None
+        self.page_range = None
+        self.sheet_range = None
         self.__outfile_name_changed = False
 
     @property
@@ -74,6 +160,8 @@ class ConverterPreferences(object):
     @infile_name.setter
     def infile_name(self, value):
         assert value == None or os.path.isfile(value)
+        if value != self._infile_name:
+            self.analysis = None
         self._infile_name = value
         # XXX: duplicate code with pfdimposer.FileConverter.__set_infile_name
         #      but the least one is called only on FileConverer instanciation
@@ -144,6 +232,79 @@ class ConverterPreferences(object):
         self.__outfile_name_changed = True
         self._outfile_name = value
 
+    def reset_outfile_name(self):
+        """Name the output file after the input file again."""
+        self.__outfile_name_changed = False
+        self._outfile_name = None
+        if self._infile_name:
+            self.infile_name = self._infile_name
+
+    @property
+    def jobs(self):
+        return self._jobs
+
+    @jobs.setter
+    def jobs(self, value):
+        assert int(value) >= 1
+        self._jobs = int(value)
+
+    @property
+    def compression(self):
+        return self._compression
+
+    @compression.setter
+    def compression(self, value):
+        assert value == None or \
+               value == pdfimposer.CompressionProfile.NONE or \
+               value == pdfimposer.CompressionProfile.FAST or \
+               value == pdfimposer.CompressionProfile.DEFAULT or \
+               value == pdfimposer.CompressionProfile.MAX
+        self._compression = value
+
+    @property
+    def map_input(self):
+        return self._map_input
+
+    @map_input.setter
+    def map_input(self, value):
+        self._map_input = bool(value)
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @cache.setter
+    def cache(self, value):
+        assert value == None or isinstance(value, pdfimposer.ResultCache)
+        self._cache = value
+
+    @property
+    def page_range(self):
+        return self._page_range
+
+    @page_range.setter
+    def page_range(self, value):
+        assert value == None or 0 <= value[0] <= value[1]
+        self._page_range = value
+
+    @property
+    def sheet_range(self):
+        return self._sheet_range
+
+    @sheet_range.setter
+    def sheet_range(self, value):
+        assert value == None or 0 <= value[0] <= value[1]
+        self._sheet_range = value
+
+    @property
+    def analysis(self):
+        return self._analysis
+
+    @analysis.setter
+    def analysis(self, value):
+        assert value == None or isinstance(value, DocumentAnalysis)
+        self._analysis = value
+
     def __str__(self):
         string = "ConverterPreferences object:\n"
         if self._infile_name:
@@ -160,6 +321,20 @@ class ConverterPreferences(object):
             string += "    paper_orientation: %s\n" % self._paper_orientation
         if self._copy_pages:
             string += "    copy_pages: %s\n" % self._copy_pages
+        if self._jobs != 1:
+            string += "    jobs: %s\n" % self._jobs
+        if self._cache:
+            string += "    cache: %s\n" % self._cache.get_directory()
+        if self._map_input:
+            string += "    map_input: %s\n" % self._map_input
+        if self._compression:
+            string += "    compression: %s\n" % self._compression
+        if self._page_range:
+            string += "    page_range: %i-%i\n" % self._page_range
+        if self._sheet_range:
+            string += "    sheet_range: %i-%i\n" % self._sheet_range
+        if self._analysis:
+            string += "    analysis: %s\n" % self._analysis
         return string
 
     def create_converter(self, overwrite_outfile_callback=None):
@@ -168,17 +343,52 @@ class ConverterPreferences(object):
             return None
         elif self._outfile_name:
             converter = TypedFileConverter(self._infile_name, self._outfile_name,
-                overwrite_outfile_callback=overwrite_outfile_callback)
+                overwrite_outfile_callback=overwrite_outfile_callback,
+                map_input=self._map_input)
         else:
             converter = TypedFileConverter(self._infile_name,
-                overwrite_outfile_callback=overwrite_outfile_callback)
+                overwrite_outfile_callback=overwrite_outfile_callback,
+                map_input=self._map_input)
         if self._conversion_type: converter.set_conversion_type(self._conversion_type)
+        self.__set_plan_preferences(converter)
+        converter.set_jobs(self._jobs)
+        converter.set_cache(self._cache)
+        if self._compression:
+            converter.set_compression_profile(self._compression)
+        if self._analysis and self._analysis.is_current(self._infile_name):
+            # The input document is not read again to compute the plan
+            converter.set_page_geometry(self._analysis.page_geometry)
+        return converter
+
+    def __set_plan_preferences(self, converter):
+        """Apply the preferences which the plan depends on to a converter."""
         if self._layout: converter.set_layout(self._layout)
         if self._paper_format: converter.set_output_format(self._paper_format)
         if self._paper_orientation:
             converter._set_output_orientation(self._paper_orientation)
         if self._copy_pages: converter.set_copy_pages(self._copy_pages)
-        return converter
+        converter.set_page_range(self._page_range)
+        converter.set_sheet_range(self._sheet_range)
+
+    def get_plan(self):
+        """Compute the plan of the conversion from the analysis of the input
+        file (see DocumentAnalysis), without reading it again.
+
+        :Returns:
+            A pdfimposer.ImpositionPlan.
+
+        :Raises MissingInputFileError: if the input file was not analysed.
+        :Raises pdfimposer.PdfConvError: if the preferences are incompatible
+            with the input file (e.g.
+            pdfimposer.MismachingOrientationsError).
+        """
+        if not self._analysis:
+            raise MissingInputFileError
+        converter = pdfimposer.StreamConverter(None, None)
+        converter.set_page_geometry(self._analysis.page_geometry)
+        self.__set_plan_preferences(converter)
+        return converter.get_plan(CONVERSIONS[
+            self._conversion_type or ConversionType.BOOKLETIZE])
 
 class TypedFileConverter(pdfimposer.FileConverter):
     """A FileConverter that stores the conversion type.
@@ -191,7 +401,10 @@ class TypedFileConverter(pdfimposer.FileConverter):
                  layout='2x1',
                  format='A4',
                  copy_pages=False,
-                 overwrite_outfile_callback=None):
+                 overwrite_outfile_callback=None,
+                 placement_engine=pdfimposer.PlacementEngine.MERGE,
+                 jobs=1,
+                 map_input=False):
 
         """Create a TypedFileConverter.
 
@@ -208,10 +421,20 @@ class TypedFileConverter(pdfimposer.FileConverter):
           - `copy_pages`: Wether the same group of input pages shoud be copied
             to fill the corresponding output page or not (see
             set_copy_pages).
+          - `overwrite_outfile_callback`: A callback function which is called
+            if outfile_name already exists (see pdfimposer.FileConverter).
+          - `placement_engine`: The way input pages are put on output pages
+            when caling run() (see set_placement_engine).
+          - `jobs`: The number of processes building output pages (see
+            set_jobs).
+          - `map_input`: Wether to map the input file in memory (see
+            pdfimposer.FileConverter).
         """
         
         pdfimposer.FileConverter.__init__(self, infile_name, outfile_name,
-                                         layout, format, copy_pages, overwrite_outfile_callback)
+                                         layout, format, copy_pages,
+                                         overwrite_outfile_callback,
+                                         placement_engine, jobs, map_input)
         self._conversion_type = conversion_type
 
     # CONVERSION FUNCTIONS
@@ -230,6 +453,21 @@ class TypedFileConverter(pdfimposer.FileConverter):
         elif self.get_conversion_type() == ConversionType.REDUCE:
             self.reduce()
 
+    def plan(self, conversion=None):
+        """Describe a conversion without performing it.
+
+        :Parameters:
+          - `conversion`: A constant from pdfimposer.Conversion. If ommited,
+            describes the conversion that would be performed by run().
+
+        :Returns:
+            A dictionnary which can be written as JSON (see
+            pdfimposer.AbstractConverter.plan).
+        """
+        if conversion is None:
+            conversion = CONVERSIONS[self.get_conversion_type()]
+        return pdfimposer.FileConverter.plan(self, conversion)
+
     # GETTERS AND SETTERS SECTION
     # ===========================
 
@@ -254,3 +492,368 @@ class TypedFileConverter(pdfimposer.FileConverter):
         return self._conversion_type
 
 
+
+class BatchResult(object):
+    """The result of the conversion of one file of a batch.
+
+    The attributes are:
+      - `infile_name`: the name of the input PDF file;
+      - `outfile_name`: the name of the output PDF file, or None;
+      - `page_count`: the number of input pages converted;
+      - `error`: None if the file was converted, a message explaining why
+        it was not otherwise;
+      - `skipped`: True if the file was not converted because the output
+        file already exists.
+    """
+    def __init__(self, infile_name):
+        self.infile_name = infile_name
+        self.outfile_name = None
+        self.page_count = 0
+        self.error = None
+        self.skipped = False
+
+def convert_batch_file(item):
+    """Convert one file of a batch.
+
+    No exception is raised: errors are reported in the result.
+
+    :Parameters:
+      - `item`: A tuple (preferences, infile_name, overwrite) where
+        preferences is the ConverterPreferences shared by the batch,
+        infile_name the name of the input PDF file, and overwrite wether
+        to overwrite existing output files or not.
+
+    :Returns:
+        A BatchResult.
+    """
+    preferences, infile_name, overwrite = item
+    result = BatchResult(infile_name)
+    try:
+        if not os.path.isfile(infile_name):
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT),
+                          infile_name)
+        preferences = copy.copy(preferences)
+        preferences.infile_name = infile_name
+        result.outfile_name = preferences.outfile_name
+        with preferences.create_converter(
+                lambda filename: overwrite) as converter:
+            converter.set_progress_callback(lambda message, progress: None)
+            converter.run()
+            result.page_count = converter.get_page_count()
+    except pdfimposer.UserInterruptError:
+        result.skipped = True
+    except Exception, e:
+        result.error = "%s: %s" % (e.__class__.__name__, e)
+    return result
+
+def convert_batch(preferences, infile_names, jobs=1, overwrite=True):
+    """Convert many files with the same preferences.
+
+    A file that can not be converted does not stop the conversion of the
+    other ones.
+
+    :Parameters:
+      - `preferences`: The ConverterPreferences to apply to all files. Its
+        input and output file names are ignored, each output file is named
+        after its input file.
+      - `infile_names`: The names of the input PDF files.
+      - `jobs`: The number of files converted at the same time, each in
+        its own process.
+      - `overwrite`: Wether to overwrite existing output files or not.
+
+    :Returns:
+        An iterator over the BatchResult of each file, in the order the
+        conversions finish.
+    """
+    assert int(jobs) >= 1
+    preferences = copy.copy(preferences)
+    preferences.jobs = 1
+    preferences.reset_outfile_name()
+    items = [(preferences, infile_name, overwrite)
+             for infile_name in infile_names]
+
+    if jobs == 1:
+        for item in items:
+            yield convert_batch_file(item)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(convert_batch_file, items):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+class ConversionEvent:
+    """The kinds of messages sent by a ConversionProcess"""
+    PROGRESS = "progress"
+    """The conversion progressed, the message is (PROGRESS, text, fraction)"""
+    DONE = "done"
+    """The conversion succeeded, the message is (DONE, outfile_name)"""
+    CANCELLED = "cancelled"
+    """The conversion was cancelled, the message is (CANCELLED,)"""
+    FAILED = "failed"
+    """The conversion failed, the message is (FAILED, error)"""
+
+def run_conversion_process(preferences, connection):
+    """Perform a conversion and report it through a connection.
+
+    This is the target of the process of a ConversionProcess. The process
+    stops converting as soon as it receives SIGTERM, and the converter
+    removes the partial output file.
+
+    :Parameters:
+      - `preferences`: The ConverterPreferences of the conversion.
+      - `connection`: The multiprocessing connection to send the
+        ConversionEvent messages to.
+    """
+    pid = os.getpid()
+    def terminate(signum, frame):
+        if os.getpid() != pid:
+            # The worker processes forked by the converter are terminated
+            # as usual
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        raise pdfimposer.UserInterruptError()
+    signal.signal(signal.SIGTERM, terminate)
+
+    def progress_callback(message, progress):
+        connection.send((ConversionEvent.PROGRESS, message, progress))
+
+    try:
+        try:
+            # The user was asked before starting the process
+            with preferences.create_converter(
+                    lambda filename: True) as converter:
+                converter.set_progress_callback(progress_callback)
+                converter.run()
+                outfile_name = converter.get_outfile_name()
+        except pdfimposer.UserInterruptError:
+            connection.send((ConversionEvent.CANCELLED,))
+        except Exception, e:
+            connection.send((ConversionEvent.FAILED,
+                             "%s: %s" % (e.__class__.__name__, e)))
+        else:
+            connection.send((ConversionEvent.DONE, outfile_name))
+    except pdfimposer.UserInterruptError:
+        # SIGTERM was received while reporting the result
+        pass
+    finally:
+        connection.close()
+
+class ConversionProcess(object):
+    """A conversion performed in a child process.
+
+    Unlike a conversion performed in a thread, it does not compete with the
+    user interface for the global interpreter lock, and it can be stopped
+    at any time. The progress and the result of the conversion are received
+    as ConversionEvent messages through a pipe, whose file descriptor (see
+    fileno) can be watched by the main loop of the user interface.
+    """
+    def __init__(self, preferences, overwrite_outfile_callback=None):
+        """Create a ConversionProcess.
+
+        :Parameters:
+          - `preferences`: The ConverterPreferences of the conversion. It is
+            copied, so that it can be changed while the conversion runs.
+          - `overwrite_outfile_callback`: A callback function which is
+            called if the output file already exists (see
+            pdfimposer.FileConverter).
+
+        :Raises MissingInputFileError: if no input file was given.
+        :Raises pdfimposer.UserInterruptError: if the output file exists
+            and must not be overwritten.
+        """
+        if not preferences.infile_name:
+            raise MissingInputFileError
+        outfile_name = preferences.outfile_name
+        if (outfile_name and os.path.exists(outfile_name) and
+                overwrite_outfile_callback and
+                not overwrite_outfile_callback(os.path.abspath(outfile_name))):
+            raise pdfimposer.UserInterruptError()
+        self.__preferences = copy.copy(preferences)
+        self.__connection = None
+        self.__process = None
+        self.__finished = False
+        self.__cancelled = False
+
+    def get_preferences(self):
+        """Get the preferences of the conversion.
+
+        :Returns:
+            A ConverterPreferences.
+        """
+        return self.__preferences
+
+    def start(self):
+        """Start the child process."""
+        assert self.__process is None
+        self.__connection, child_connection = multiprocessing.Pipe(False)
+        self.__process = multiprocessing.Process(
+            target=run_conversion_process,
+            args=(self.__preferences, child_connection))
+        self.__process.start()
+        # Only the child writes to the pipe, so that the end of file is
+        # seen as soon as it exits
+        child_connection.close()
+
+    def is_started(self):
+        """Get wether the child process was started.
+
+        :Returns:
+            True if start() was called.
+        """
+        return self.__process is not None
+
+    def fileno(self):
+        """Get the file descriptor to watch for messages.
+
+        :Returns:
+            A file descriptor which becomes readable when a message is
+            available or when the child process exited.
+        """
+        return self.__connection.fileno()
+
+    def receive(self):
+        """Get the messages sent by the child process so far.
+
+        This never blocks. Once the last message was received, the child
+        process is waited for and is_finished() returns True.
+
+        :Returns:
+            A list of ConversionEvent messages.
+        """
+        messages = []
+        while not self.__finished and self.__connection.poll():
+            try:
+                message = self.__connection.recv()
+            except EOFError:
+                # The child exited without reporting its result
+                self.__finish()
+                if self.__cancelled:
+                    messages.append((ConversionEvent.CANCELLED,))
+                else:
+                    messages.append((ConversionEvent.FAILED,
+                        _("The conversion process exited with code %i") %
+                        self.__process.exitcode))
+                break
+            messages.append(message)
+            if message[0] != ConversionEvent.PROGRESS:
+                self.__finish()
+        return messages
+
+    def __finish(self):
+        """Release the pipe and wait for the child process."""
+        self.__finished = True
+        self.__connection.close()
+        self.__process.join()
+
+    def is_finished(self):
+        """Get wether the result of the conversion was received.
+
+        :Returns:
+            True if the child process exited and its result was received.
+        """
+        return self.__finished
+
+    def cancel(self):
+        """Stop the conversion.
+
+        The child process is terminated at once, and a CANCELLED message
+        is received unless the conversion was already finished.
+        """
+        if self.__process is not None and not self.__finished:
+            self.__cancelled = True
+            self.__process.terminate()
+
+class ConversionQueue(object):
+    """Conversions waiting to be performed, a bounded number at a time.
+
+    Each conversion is a ConversionProcess, so that conversions performed
+    at the same time use several processors.
+    """
+    def __init__(self, max_running=None):
+        """Create a ConversionQueue.
+
+        :Parameters:
+          - `max_running`: The number of conversions performed at the same
+            time. If ommited, defaults to the number of processors.
+        """
+        if max_running is None:
+            max_running = multiprocessing.cpu_count()
+        assert int(max_running) >= 1
+        self.__max_running = int(max_running)
+        self.__processes = []
+
+    def get_max_running(self):
+        """Get the number of conversions performed at the same time.
+
+        :Returns:
+            The number of conversions performed at the same time.
+        """
+        return self.__max_running
+
+    def add(self, process):
+        """Append a conversion to the queue.
+
+        It is only started by start_pending().
+
+        :Parameters:
+          - `process`: A ConversionProcess which was not started.
+        """
+        assert not process.is_started()
+        self.__processes.append(process)
+
+    def get_processes(self):
+        """Get the conversions which are waiting or running.
+
+        :Returns:
+            A list of ConversionProcess, in the order they were added.
+        """
+        return [process for process in self.__processes
+                if not process.is_finished()]
+
+    def start_pending(self):
+        """Start the first waiting conversions, as long as less than
+        max_running conversions are running.
+
+        This should be called after adding a conversion and after the
+        result of a conversion was received.
+
+        :Returns:
+            The list of the ConversionProcess which were started.
+        """
+        self.__processes = self.get_processes()
+        running = len([process for process in self.__processes
+                       if process.is_started()])
+        started = []
+        for process in self.__processes:
+            if running >= self.__max_running:
+                break
+            if not process.is_started():
+                process.start()
+                started.append(process)
+                running += 1
+        return started
+
+    def cancel(self, process):
+        """Cancel a conversion.
+
+        A waiting conversion is removed from the queue, a running one is
+        terminated (see ConversionProcess.cancel).
+
+        :Parameters:
+          - `process`: A ConversionProcess of the queue.
+        """
+        if process.is_started():
+            process.cancel()
+        elif process in self.__processes:
+            self.__processes.remove(process)
+
+    def cancel_all(self):
+        """Cancel all the conversions of the queue."""
+        for process in self.get_processes():
+            self.cancel(process)
@@ -57,3 +57,16 @@ def get_helpdir():
 
 def get_localedir():
     return os.path.join(get_sharedir(), "locale")
+
+def install_gettext():
+    """Install the _() function translating the messages of the program."""
+    gettext.install("bookletimposer", localedir=get_localedir(), unicode=True)
+
+def bind_ui_textdomain():
+    """Set up the translation of the GtkBuilder user interface files.
+
+    This is only needed by the graphical user interface, as GtkBuilder
+    translates through the C library.
+    """
+    locale.setlocale(locale.LC_ALL, '')
+    locale.bindtextdomain("bookletimposer", get_localedir())
@@ -40,10 +40,8 @@ from gi.repository import Gio
 
 import sys
 import os
-from subprocess import call
-
-import threading
-import traceback
+import multiprocessing
+from subprocess import Popen
 
 import pdfimposer # We need its exceptions
 
@@ -51,11 +49,7 @@ import backend
 import config
 from config import debug
 
-class UserInterrupt(backend.BookletImposerError):
-    """Exception raised when the user interrupted the conversion
-
-    """
-    # XXX: this is probably not the right way to do...
+config.bind_ui_textdomain()
 
 class BookletImposerUI(object):
     """BookletImposer graphical user interface
@@ -70,9 +64,16 @@ class BookletImposerUI(object):
             self.__preferences = preferences
         else:
             self.__preferences = backend.ConverterPreferences()
+        self.__conversion_queue = backend.ConversionQueue()
+        self.__job_rows = {}
+        self.__analysis_pool = None
+        # The plan shown in the preview and the size of its input pages
+        self.__preview = None
         self.__create_gui()
         if preferences:
             self.__apply_preferences()
+            if preferences.infile_name:
+                self.__analyze_infile()
         self.__main_window.show()
 
     def __create_gui(self):
@@ -95,11 +96,13 @@ class BookletImposerUI(object):
         self.__paper_format_combobox = \
             builder.get_object("output_paper_format_combobox")
         self.__output_file_chooser_button = self.__create_output_file_chooser_button(builder)
-        self.__progressbar_conversion = builder.get_object("conversion_progressbar")
+        self.__analysis_label = builder.get_object("analysis_label")
+        self.__preview_drawingarea = builder.get_object("preview_drawingarea")
+        self.__jobs_scrolledwindow = builder.get_object("jobs_scrolledwindow")
+        self.__jobs_box = builder.get_object("jobs_box")
         self.__about_button = builder.get_object("about_button")
         self.__help_button = builder.get_object("help_button")
         self.__apply_button = builder.get_object("apply_button")
-        self.__stop_button = builder.get_object("stop_button")
 
         self.__about_dialog = builder.get_object("about_dialog")
 
@@ -204,29 +207,57 @@ class BookletImposerUI(object):
     def cb_infile_set(self, widget, data=None):
         self.__preferences.infile_name = widget.get_filename()
         self.__apply_preferences()
+        self.__analyze_infile()
+
+    def cb_analysis_done(self, infile_name, analysis, error):
+        if infile_name != self.__preferences.infile_name:
+            # Another file was chosen in the meantime
+            return False
+        if error:
+            self.__analysis_label.set_markup(
+                "<span foreground='red'>%s</span>" %
+                GLib.markup_escape_text(error))
+            self.__set_preview(None)
+        else:
+            self.__preferences.analysis = analysis
+            self.__update_analysis()
+        return False
+
+    def cb_preview_draw(self, widget, cr):
+        if self.__preview:
+            plan, input_size = self.__preview
+            self.draw_plan(cr, plan, input_size, widget.get_allocated_width(),
+                           widget.get_allocated_height())
+        return False
 
     def cb_bookletize_toggled(self, widget, data=None):
         if widget.get_active():
             self.__preferences.conversion_type = backend.ConversionType.BOOKLETIZE
+            self.__update_analysis()
 
     def cb_linearize_toggled(self, widget, data=None):
         if widget.get_active():
             self.__preferences.conversion_type = backend.ConversionType.LINEARIZE
+            self.__update_analysis()
 
     def cb_reduce_toggled(self, widget, data=None):
         if widget.get_active():
             self.__preferences.conversion_type = backend.ConversionType.REDUCE
+            self.__update_analysis()
 
     def cb_copy_pages_toggled(self, widget, data=None):
         self.__preferences.copy_pages = widget.get_active()
+        self.__update_analysis()
 
     def cb_layout_changed(self, widget, data=None):
         self.__preferences.layout = widget.get_model().get_value(
             widget.get_active_iter(), 0)
+        self.__update_analysis()
 
     def cb_paper_format_changed(self, widget, data=None):
         self.__preferences.paper_format = widget.get_model().get_value(
             widget.get_active_iter(), 0)
+        self.__update_analysis()
 
     def cb_outfile_clicked(self, widget, data=None):
         fcdialog = Gtk.FileChooserDialog(
@@ -268,45 +299,251 @@ class BookletImposerUI(object):
         self.run_conversion()
         pass
 
-    def cb_progress_stop(self, widget, data=None):
-        self.__stop.set()
-        self.__progressbar_conversion.set_text(_("Cancel triggered, please wait..."))
+    def cb_job_stop(self, widget, conversion_process):
+        self.__conversion_queue.cancel(conversion_process)
+        if conversion_process.is_started():
+            progressbar = self.__job_rows[conversion_process][1]
+            progressbar.set_text(_("Cancel triggered, please wait..."))
+            widget.set_sensitive(False)
+        else:
+            self.__remove_job_row(conversion_process)
+
+    def cb_conversion_event(self, fd, condition, conversion_process):
+        # Conversions run in other processes, so that the user interface
+        # stays responsive: their messages are handled here, in the main
+        # loop
+        progressbar = self.__job_rows[conversion_process][1]
+        name = os.path.basename(conversion_process.get_preferences().infile_name)
+        for message in conversion_process.receive():
+            if message[0] == backend.ConversionEvent.PROGRESS:
+                progressbar.set_fraction(message[2])
+                progressbar.set_text("%s: %s" % (name, message[1]))
+            elif message[0] == backend.ConversionEvent.DONE:
+                self.__remove_job_row(conversion_process)
+                self.open_file(message[1])
+            elif message[0] == backend.ConversionEvent.CANCELLED:
+                # The converter removed the partial output file
+                self.__remove_job_row(conversion_process)
+            else:
+                debug(message[1])
+                self.__remove_job_row(conversion_process)
+                self.show_exception_dialog(message[1])
+        if conversion_process.is_finished():
+            self.__start_pending_conversions()
+            return False
+        return True
 
     # ACTIONS
     
     def close_application(self):
+        self.__conversion_queue.cancel_all()
+        if self.__analysis_pool:
+            self.__analysis_pool.terminate()
         Gtk.main_quit()
 
     def show_about_dialog(self):
         self.__about_dialog.show()
 
+    def show_exception_dialog(self, exception):
+        dialog = Gtk.MessageDialog(parent=self.__main_window,
+                                   flags=Gtk.DialogFlags.MODAL,
+                                   type=Gtk.MessageType.ERROR,
+                                   buttons=Gtk.ButtonsType.CLOSE,
+                                   message_format=_("Conversion failed"))
+        dialog.format_secondary_text(str(exception))
+        dialog.run()
+        dialog.destroy()
+
+    @staticmethod
+    def open_file(filename):
+        if os.path.isfile(filename):
+            if sys.platform.startswith('linux'):
+                Popen(["xdg-open", filename])
+            else:
+                os.startfile(filename)
+
+    @staticmethod
+    def draw_plan(cr, plan, input_size, width, height):
+        """Draw a schematic view of the first output pages of a plan.
+
+        Each output page is drawn with a rectangle per slot showing the
+        number of the input page put there, or shaded if the slot is blank.
+        Only the plan is needed, not the content of the input pages, so that
+        this is fast whatever the size of the input file.
+
+        :Parameters:
+          - `cr`: The cairo.Context to draw on.
+          - `plan`: A pdfimposer.ImpositionPlan.
+          - `input_size`: A tuple (width, height) representing the size of
+            the input pages.
+          - `width`: The width of the area to draw on, in pixels.
+          - `height`: The height of the area to draw on, in pixels.
+        """
+        margin = 6
+        caption_height = 16
+        output_width, output_height = plan.get_output_size()
+        scale = float(height - 2 * margin - caption_height) / output_height
+        sheet_width = output_width * scale
+        sheet_height = output_height * scale
+        shown = int((width - margin) / (sheet_width + margin))
+        if shown < plan.get_sheet_count():
+            # Leave room for the number of output pages not shown
+            shown = int((width - margin - 40) / (sheet_width + margin))
+        shown = max(1, min(plan.get_sheet_count(), shown))
+
+        cr.select_font_face("Sans")
+        cr.set_line_width(1)
+
+        def show_centered_text(text, x, y, size):
+            cr.set_font_size(size)
+            x_bearing, y_bearing, text_width, text_height = \
+                cr.text_extents(text)[:4]
+            cr.move_to(x - text_width / 2 - x_bearing,
+                       y - text_height / 2 - y_bearing)
+            cr.show_text(text)
+
+        for sheet in range(shown):
+            left = margin + sheet * (sheet_width + margin)
+            top = margin
+            cr.rectangle(left, top, sheet_width, sheet_height)
+            cr.set_source_rgb(1, 1, 1)
+            cr.fill_preserve()
+            cr.set_source_rgb(0, 0, 0)
+            cr.stroke()
+
+            cr.save()
+            # The input pages of a linearized booklet are larger than the
+            # output pages
+            cr.rectangle(left, top, sheet_width, sheet_height)
+            cr.clip()
+            for slot, page in enumerate(plan.get_sheet(sheet)):
+                a, b, c, d, e, f = plan.get_matrix(slot)
+                xs = [a * x + c * y + e for x, y in
+                      ((0, 0), (input_size[0], input_size[1]))]
+                ys = [b * x + d * y + f for x, y in
+                      ((0, 0), (input_size[0], input_size[1]))]
+                # PDF coordinates grow upwards
+                x0 = left + min(xs) * scale
+                y0 = top + (output_height - max(ys)) * scale
+                slot_width = (max(xs) - min(xs)) * scale
+                slot_height = (max(ys) - min(ys)) * scale
+                cr.rectangle(x0 + 1, y0 + 1, slot_width - 2, slot_height - 2)
+                if page is None:
+                    cr.set_source_rgb(0.85, 0.85, 0.85)
+                else:
+                    cr.set_source_rgb(0.8, 0.87, 1)
+                cr.fill_preserve()
+                cr.set_source_rgb(0.3, 0.3, 0.3)
+                cr.stroke()
+                if page is not None:
+                    cr.set_source_rgb(0, 0, 0)
+                    show_centered_text(str(page + 1),
+                        x0 + slot_width / 2, y0 + slot_height / 2,
+                        max(6, min(slot_width, slot_height) / 3))
+            cr.restore()
+
+            if plan.get_conversion() == pdfimposer.Conversion.BOOKLETIZE:
+                if sheet % 2 == 0:
+                    caption = _("%i front") % (sheet / 2 + 1)
+                else:
+                    caption = _("%i back") % (sheet / 2 + 1)
+            else:
+                caption = str(sheet + 1)
+            cr.set_source_rgb(0, 0, 0)
+            show_centered_text(caption, left + sheet_width / 2,
+                               top + sheet_height + caption_height / 2, 10)
+
+        if shown < plan.get_sheet_count():
+            cr.set_source_rgb(0, 0, 0)
+            cr.set_font_size(10)
+            cr.move_to(margin + shown * (sheet_width + margin),
+                       margin + sheet_height / 2)
+            cr.show_text(_("+ %i") % (plan.get_sheet_count() - shown))
+
+    def __analyze_infile(self):
+        """Read the input file in the background (see
+        backend.DocumentAnalysis).
+        """
+        infile_name = self.__preferences.infile_name
+        self.__analysis_label.set_text(_("Reading %s...") %
+                                       os.path.basename(infile_name))
+        # The preview of the previous file is not valid anymore
+        self.__set_preview(None)
+        if self.__analysis_pool is None:
+            self.__analysis_pool = multiprocessing.Pool(1)
+        self.__analysis_pool.apply_async(backend.analyze_document,
+            (infile_name,),
+            callback=lambda result: GObject.idle_add(self.cb_analysis_done,
+                                                     *result))
+
+    def __update_analysis(self):
+        """Show the result of the current preferences on the analysed input
+        file, and forbid conversions which would fail.
+        """
+        analysis = self.__preferences.analysis
+        if not analysis:
+            return
+        try:
+            plan = self.__preferences.get_plan()
+        except pdfimposer.PdfConvError, e:
+            self.__analysis_label.set_markup(
+                "<span foreground='red'>%s</span>" %
+                GLib.markup_escape_text(str(e)))
+            self.__apply_button.set_sensitive(False)
+            self.__set_preview(None)
+            return
+        self.__analysis_label.set_text(_("%s, %i output pages") %
+                                       (analysis, plan.get_sheet_count()))
+        self.__apply_button.set_sensitive(True)
+        self.__set_preview((plan, analysis.page_geometry.get_size(0)))
+
+    def __set_preview(self, preview):
+        """Show another plan in the preview.
+
+        :Parameters:
+          - `preview`: A tuple (plan, input_size), or None to show nothing.
+        """
+        self.__preview = preview
+        self.__preview_drawingarea.queue_draw()
+
+    def __add_job_row(self, conversion_process):
+        name = os.path.basename(conversion_process.get_preferences().infile_name)
+        row = Gtk.HBox(spacing=6)
+        progressbar = Gtk.ProgressBar()
+        progressbar.set_show_text(True)
+        progressbar.set_text(_("%s: waiting") % name)
+        row.pack_start(progressbar, True, True, 0)
+        stop_button = Gtk.Button.new_from_stock(Gtk.STOCK_STOP)
+        stop_button.connect("clicked", self.cb_job_stop, conversion_process)
+        row.pack_start(stop_button, False, False, 0)
+        self.__jobs_box.pack_start(row, False, True, 0)
+        row.show_all()
+        self.__jobs_scrolledwindow.set_visible(True)
+        self.__job_rows[conversion_process] = (row, progressbar)
+
+    def __remove_job_row(self, conversion_process):
+        row, progressbar = self.__job_rows.pop(conversion_process)
+        row.destroy()
+        if not self.__job_rows:
+            self.__jobs_scrolledwindow.set_visible(False)
+
+    def __start_pending_conversions(self):
+        for conversion_process in self.__conversion_queue.start_pending():
+            progressbar = self.__job_rows[conversion_process][1]
+            progressbar.set_text(os.path.basename(
+                conversion_process.get_preferences().infile_name))
+            GLib.io_add_watch(conversion_process.fileno(),
+                              GLib.PRIORITY_DEFAULT,
+                              GLib.IO_IN | GLib.IO_HUP,
+                              self.cb_conversion_event, conversion_process)
+
     def run_conversion(self):
+        """Add a conversion with the current preferences to the queue.
 
-        def exception_dialog(exception):
-            dialog = Gtk.MessageDialog(parent=self.__main_window,
-                                       flags=Gtk.DialogFlags.MODAL,
-                                       type=Gtk.MessageType.ERROR,
-                                       buttons=Gtk.ButtonsType.CLOSE,
-                                       message_format=_("Conversion failed"))
-            dialog.format_secondary_text(str(exception))
-            dialog.run()
-            dialog.destroy()
-            stop_conversion_mode()
-
-        def start_conversion_mode():
-            self.__preferences_table.set_sensitive(False)
-            self.__progressbar_conversion.set_visible(True)
-            self.__progressbar_conversion.set_fraction(0)
-            self.__progressbar_conversion.set_text("")
-            self.__stop_button.set_visible(True)
-            self.__stop_button.show()
-            self.__apply_button.set_visible(False)
-
-        def stop_conversion_mode():
-            self.__preferences_table.set_sensitive(True)
-            self.__progressbar_conversion.set_visible(False)
-            self.__apply_button.set_visible(True)
-            self.__stop_button.set_visible(False)
+        The preferences can be changed as soon as the conversion was added,
+        and several conversions run at the same time (see
+        backend.ConversionQueue).
+        """
 
         def cb_overwrite_outfile(filename):
             dialog = Gtk.MessageDialog(parent=self.__main_window,
@@ -322,60 +559,17 @@ class BookletImposerUI(object):
             else:
                 return False
 
-        def cb_update_progress(message, progress):
-            # there we are inside the work of the converter,
-            # so we can to stop it if the user required to cancel
-            # the operation. To achieve that we raise an exception.
-            # XXX: that's not elegant at all
-            if self.__stop.is_set():
-                self.__progressbar_conversion.set_text(_("Conversion cancelled"))
-                raise UserInterrupt()
-            GObject.idle_add(idle_cb_update_progress, message, progress)
-
-        def idle_cb_update_progress(message, progress):
-            self.__progressbar_conversion.set_fraction(progress)
-            self.__progressbar_conversion.set_text(message)
-            return False
-
-        def idle_cb_process_exception(exception):
-            exception_dialog(exception)
-            return False
-
-        def idle_cb_finish_callback():
-            stop_conversion_mode()
-            return False
-
-        def worker():
-            try:
-                converter.run()
-                outname = converter.get_outfile_name()
-                if os.path.isfile(outname):
-                    if sys.platform.startswith('linux'):
-                        call(["xdg-open", outname])
-                    else:
-                        os.startfile(outname)
-            except UserInterrupt:
-                GObject.idle_add(idle_cb_finish_callback)
-            except Exception, e:
-                GObject.idle_add(idle_cb_process_exception, e)
-                print traceback.format_exc()
-                raise
-            GObject.idle_add(idle_cb_finish_callback)
-
-
-        start_conversion_mode()
         try:
-            converter = self.__preferences.create_converter(cb_overwrite_outfile)
+            conversion_process = backend.ConversionProcess(
+                self.__preferences, cb_overwrite_outfile)
         except pdfimposer.UserInterruptError:
-            stop_conversion_mode()
             return
         except Exception, e:
-            exception_dialog(e)
+            self.show_exception_dialog(e)
             raise
-        converter.set_progress_callback(cb_update_progress)
-        self.__stop = threading.Event()
-        converter_thread = threading.Thread(target=worker)
-        converter_thread.start()
+        self.__add_job_row(conversion_process)
+        self.__conversion_queue.add(conversion_process)
+        self.__start_pending_conversions()
 
 if __name__ == "__main__":
     ui = BookletImposerUI()
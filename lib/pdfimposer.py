@@ -52,6 +52,18 @@ import re
 import sys
 import os
 import types
+import time
+import tempfile
+import shutil
+import hashlib
+import array
+import mmap
+import threading
+import multiprocessing
+import multiprocessing.pool
+import collections
+import zlib
+from cStringIO import StringIO
 
 import pyPdf
 import pyPdf.generic
@@ -65,6 +77,8 @@ except NameError:
 
 __docformat__ = "restructuredtext"
 
+__version__ = "0.2"
+
 ########################################################################
 
 # CONSTANTS
@@ -76,6 +90,54 @@ class PageOrientation:
     LANDSCAPE = True
     """The lanscape orientation"""
 
+class PlacementEngine:
+    """The placement engine constants"""
+    MERGE = "merge"
+    """Merge the content stream of each input page into the output page"""
+    XOBJECT = "xobject"
+    """Wrap each input page once in a Form XObject and draw it where needed"""
+    FAST_MERGE = "fast-merge"
+    """Merge input pages without parsing their content streams"""
+
+class CompressionProfile:
+    """The compression profile constants"""
+    NONE = "none"
+    """Do not compress content streams"""
+    FAST = "fast"
+    """Compress content streams as fast as possible"""
+    DEFAULT = "default"
+    """Compress content streams with the default zlib level"""
+    MAX = "max"
+    """Compress content streams as much as possible"""
+
+_compression_levels = {
+    CompressionProfile.NONE: None,
+    CompressionProfile.FAST: 1,
+    CompressionProfile.DEFAULT: 6,
+    CompressionProfile.MAX: 9,
+    }
+"""The zlib compression level of each profile"""
+
+class Conversion:
+    """The conversion constants"""
+    BOOKLETIZE = "bookletize"
+    """Convert a linear document to a booklet"""
+    LINEARIZE = "linearize"
+    """Convert a booklet to a linear document"""
+    REDUCE = "reduce"
+    """Put multiple input pages on one output page"""
+
+class ProgressPhase:
+    """The conversion phase constants"""
+    CREATE = "create"
+    """Output pages are being created from input pages"""
+    EXTRACT = "extract"
+    """Output pages are being extracted from input pages"""
+    WRITE = "write"
+    """The end of the output document is being written"""
+    DONE = "done"
+    """The conversion is finished"""
+
 ########################################################################
 
 class PdfConvError(Exception):
@@ -117,12 +179,1152 @@ class UnknownFormatError(PdfConvError):
 ########################################################################
 
 
+class InvalidRangeError(PdfConvError):
+    """
+    This exception is raised if a range of input pages or output pages
+    does not contain any page of the document.
+
+    The attribute "message" contains the problematic range.
+    """
+    def __str__(self):
+        return _("The range %i-%i does not contain any page") % \
+            (self.message[0] + 1, self.message[1] + 1)
+
+########################################################################
+
 class UserInterruptError(PdfConvError):
     """
     This exception is raised when the user interrupts the conversion.
     """
     def __str__(self):
-        return _('User interruption') % self.message
+        return _('User interruption')
+
+########################################################################
+
+class _CountingStream(object):
+    """
+    A write-only file-like object counting the bytes written through it.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+class _DigestStream(object):
+    """
+    A write-only file-like object computing the digest of what is written
+    through it.
+    """
+    def __init__(self):
+        # Collisions could only be crafted within the converted document
+        # itself, MD5 is much faster than SHA-1
+        self.digest = hashlib.md5()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+
+def _replace_file(source, destination):
+    """
+    Rename a file, replacing the destination file if it exists.
+
+    :Parameters:
+      - `source` The name of the file to rename.
+      - `destination` The new name of the file.
+    """
+    if sys.platform.startswith('win') and os.path.exists(destination):
+        # rename() does not replace existing files on Windows
+        os.remove(destination)
+    os.rename(source, destination)
+
+def _compress(data, level):
+    """
+    Flate encode data.
+
+    This is run in the threads of a compression pool: zlib releases the
+    global interpreter lock while compressing.
+
+    :Parameters:
+      - `data` The data to encode.
+      - `level` The zlib compression level.
+
+    :Returns:
+        A tuple (encoded data, duration of the compression in seconds).
+    """
+    start = time.time()
+    data = zlib.compress(data, level)
+    return data, time.time() - start
+
+def _create_stream(data, level):
+    """
+    Create a stream object.
+
+    :Parameters:
+      - `data` The data of the stream, already Flate encoded if level is
+        not None.
+      - `level` The zlib compression level data was encoded with, or None
+        if it is not encoded.
+
+    :Returns:
+        A pyPdf.generic.StreamObject.
+    """
+    if level is None:
+        stream = pyPdf.generic.DecodedStreamObject()
+    else:
+        stream = pyPdf.generic.EncodedStreamObject()
+        stream[pyPdf.generic.NameObject("/Filter")] = \
+            pyPdf.generic.NameObject("/FlateDecode")
+    stream._data = data
+    return stream
+
+class _DeferredStreamObject(pyPdf.generic.EncodedStreamObject):
+    """
+    A Flate encoded stream whose data is being compressed in a thread pool.
+
+    The compression is only waited for when the stream is written.
+    """
+    def __init__(self, result, stats):
+        """
+        Create a _DeferredStreamObject.
+
+        :Parameters:
+          - `result` The multiprocessing.pool.AsyncResult of _compress.
+          - `stats` The _Stats to which the compression is accounted.
+        """
+        pyPdf.generic.EncodedStreamObject.__init__(self)
+        self[pyPdf.generic.NameObject("/Filter")] = \
+            pyPdf.generic.NameObject("/FlateDecode")
+        self.__result = result
+        self.__stats = stats
+
+    def writeToStream(self, stream, encryption_key):
+        if self.__result is not None:
+            self._data, duration = self.__result.get()
+            self.__result = None
+            self.__stats.add({"time_compress": duration,
+                              "bytes_compressed": len(self._data)})
+        pyPdf.generic.EncodedStreamObject.writeToStream(self, stream,
+                                                        encryption_key)
+
+class _LazySequence(object):
+    """
+    A read-only sequence whose items are computed when they are accessed.
+    """
+    __slots__ = ("_length", "_get_item")
+
+    def __init__(self, length, get_item):
+        """
+        Create a _LazySequence.
+
+        :Parameters:
+          - `length` The number of items of the sequence.
+          - `get_item` A function returning the item at a given position.
+        """
+        self._length = length
+        self._get_item = get_item
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError(position)
+        return self._get_item(position)
+
+    def __iter__(self):
+        for position in xrange(self._length):
+            yield self._get_item(position)
+
+class _Stats(object):
+    """
+    The per-phase timers and counters of a conversion.
+
+    Nothing is measured while it is disabled, so that the instrumented code
+    only pays for a test.
+    """
+    PHASES = ("parse", "merge", "compress", "write")
+    """The phases whose duration is measured"""
+    COUNTERS = ("sheets", "pages_parsed", "cells_merged", "bytes_compressed",
+                "bytes_written")
+    """The counters"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.values = dict.fromkeys(["time_" + phase
+                                     for phase in self.PHASES], 0.)
+        self.values.update(dict.fromkeys(self.COUNTERS, 0))
+
+    def start(self):
+        """
+        Start measuring a phase.
+
+        :Returns:
+            A value to give to stop().
+        """
+        if self.enabled:
+            return time.time()
+
+    def stop(self, phase, start):
+        """
+        Stop measuring a phase.
+
+        :Parameters:
+          - `phase` The phase, among PHASES.
+          - `start` The value returned by start().
+
+        :Returns:
+            A value to give to stop() to measure the next phase.
+        """
+        if self.enabled:
+            now = time.time()
+            self.values["time_" + phase] += now - start
+            return now
+
+    def count(self, counter, value=1):
+        """
+        Increase a counter.
+
+        :Parameters:
+          - `counter` The counter, among COUNTERS.
+          - `value` The amount to add.
+        """
+        if self.enabled:
+            self.values[counter] += value
+
+    def add(self, values):
+        """
+        Add timers and counters measured elsewhere (e.g. in a worker).
+
+        :Parameters:
+          - `values` The values attribute of another _Stats.
+        """
+        if self.enabled:
+            for key, value in values.items():
+                self.values[key] += value
+
+def _release_objects(pdf):
+    """
+    Forget the objects read by a pyPdf.PdfFileReader.
+
+    The reader keeps every object it has read, along with the decoded data
+    of streams, so that its memory usage grows with the number of pages
+    read. Forgotten objects are read again if they are needed; the list of
+    pages is kept.
+
+    :Parameters:
+      - `pdf` The pyPdf.PdfFileReader.
+    """
+    for objects in pdf.resolvedObjects.values():
+        objects.clear()
+
+def _multiply_matrices(first, second):
+    """
+    Compose two transformation matrices.
+
+    :Parameters:
+      - `first` The matrix applied first, a sequence of 6 numbers.
+      - `second` The matrix applied next, a sequence of 6 numbers.
+
+    :Returns:
+        A tuple of 6 numbers.
+    """
+    a1, b1, c1, d1, e1, f1 = first
+    a2, b2, c2, d2, e2, f2 = second
+    return (a1 * a2 + b1 * c2, a1 * b2 + b1 * d2,
+            c1 * a2 + d1 * c2, c1 * b2 + d1 * d2,
+            e1 * a2 + f1 * c2 + e2, e1 * b2 + f1 * d2 + f2)
+
+class StreamingPdfWriter(pyPdf.PdfFileWriter):
+    """
+    A pyPdf.PdfFileWriter which writes the document while it is built.
+
+    Each call to flush() writes the objects added since the previous call,
+    along with the input objects they reference, and releases them. The
+    references of the objects can be resolved earlier by sweep(), so that
+    the objects are numbered the same way however late they are written. The
+    page tree, the catalog and the document information are written by
+    close(), followed by the cross-reference table and the trailer.
+
+    Objects must not be accessed through getObject() once they have been
+    flushed, and write() must not be used.
+
+    Each input object is written once, however many output objects
+    reference it. Input objects whose content is identical to an object
+    already written, once their own references are resolved, are not
+    written again: references to them point to the first one. Direct
+    resource dictionaries of output objects which are used again are
+    written once as an indirect object shared by the following objects,
+    unless they are too small for it to be worth it.
+    """
+
+    MIN_SHARED_RESOURCES_SIZE = 64
+    """The minimum size of the shared resource dictionaries, in bytes"""
+
+    def __init__(self, stream, cancellation_token=None):
+        """
+        Create a StreamingPdfWriter.
+
+        :Parameters:
+          - `stream` The file-like object to which the PDF document should
+            be written. Only its write() method is used.
+          - `cancellation_token` A CancellationToken checked before writing
+            each object, or None.
+        """
+        pyPdf.PdfFileWriter.__init__(self)
+        self.__cancellation_token = cancellation_token
+        self.__stream = _CountingStream(stream)
+        self.__object_positions = {}
+        self.__external_references = {}
+        self.__object_digests = {}
+        self.__resources_digests = {}
+        self.__pending_objects = set()
+        self.__cyclic_objects = set()
+        self.__free_objects = set()
+        self.__document_objects = \
+            (self._pages.idnum, self._info.idnum, self._root.idnum)
+        self.__next_swept = len(self._objects)
+        self.__next_written = len(self._objects)
+        self.__stream.write(self._header + "\n")
+
+    def tell(self):
+        """
+        Return the number of bytes written to the stream so far.
+        """
+        return self.__stream.tell()
+
+    @staticmethod
+    def __get_digest(data):
+        """
+        Compute the digest of the serialized form of an object.
+
+        :Returns:
+            A tuple (digest, size of the serialized form).
+        """
+        stream = _DigestStream()
+        data.writeToStream(stream, None)
+        return stream.digest.digest(), stream.size
+
+    def _sweepIndirectReferences(self, externMap, data):
+        """
+        Replace the references to input objects in data by references to
+        output objects, adding these output objects as needed.
+
+        Input objects are shared by identity, through externMap, and by
+        content.
+        """
+        if not isinstance(data, pyPdf.generic.IndirectObject) or \
+                data.pdf == self:
+            return pyPdf.PdfFileWriter._sweepIndirectReferences(
+                self, externMap, data)
+
+        reference = externMap.get(data.pdf, {}).get(
+            data.generation, {}).get(data.idnum, None)
+        if reference is not None:
+            if reference.idnum in self.__pending_objects:
+                # A reference cycle: the objects involved are not shared
+                # by content, as some references to them were already made
+                self.__cyclic_objects.update(self.__pending_objects)
+            return reference
+
+        # The parent class adds the object at the end
+        idnum = len(self._objects) + 1
+        self.__pending_objects.add(idnum)
+        reference = pyPdf.PdfFileWriter._sweepIndirectReferences(
+            self, externMap, data)
+        self.__pending_objects.remove(idnum)
+        if idnum in self.__cyclic_objects:
+            return reference
+
+        digest = self.__get_digest(self._objects[idnum - 1])[0]
+        shared = self.__object_digests.get(digest)
+        if shared is None:
+            self.__object_digests[digest] = reference
+            return reference
+        self._objects[idnum - 1] = None
+        self.__free_objects.add(idnum)
+        externMap[data.pdf][data.generation][data.idnum] = shared
+        return shared
+
+    def __share_resources(self, data):
+        """
+        Replace the direct resource dictionary of an object by a reference
+        to an identical dictionary, or to a new indirect object.
+
+        :Parameters:
+          - `data` An output object, whose references were swept.
+        """
+        if not isinstance(data, pyPdf.generic.DictionaryObject):
+            return
+        resources = data.raw_get("/Resources") \
+                    if "/Resources" in data else None
+        if not isinstance(resources, pyPdf.generic.DictionaryObject):
+            return
+        digest, size = self.__get_digest(resources)
+        if size < self.MIN_SHARED_RESOURCES_SIZE:
+            return
+        if digest not in self.__resources_digests:
+            # Written directly the first time, as it may not be used again
+            self.__resources_digests[digest] = None
+            return
+        reference = self.__resources_digests[digest]
+        if reference is None:
+            reference = self._addObject(resources)
+            self.__resources_digests[digest] = reference
+        data[pyPdf.generic.NameObject("/Resources")] = reference
+
+    def __write_object(self, idnum):
+        """
+        Write an object to the stream and release it.
+
+        :Parameters:
+          - `idnum` The number of the object to write.
+
+        :Raises UserInterruptError: if the cancellation token was cancelled.
+        """
+        if self.__cancellation_token:
+            self.__cancellation_token.check()
+        self.__object_positions[idnum] = self.__stream.tell()
+        self.__stream.write("%i 0 obj\n" % idnum)
+        self._objects[idnum - 1].writeToStream(self.__stream, None)
+        self.__stream.write("\nendobj\n")
+        self._objects[idnum - 1] = None
+
+    def sweep(self, until=None):
+        """
+        Resolve the references of the objects added since the last call,
+        adding the input objects they reference, without writing them.
+
+        :Parameters:
+          - `until` The number of the last object to sweep, or None to
+            sweep all of them. The input objects referenced by the swept
+            objects are then swept by a later call.
+        """
+        # The page tree is only written by close()
+        self.stack = [self._pages.idnum]
+        while self.__next_swept < len(self._objects) and \
+                (until is None or self.__next_swept < until):
+            idnum = self.__next_swept + 1
+            self.__next_swept += 1
+            if idnum in self.__document_objects or \
+                    idnum in self.__free_objects:
+                continue
+            self._sweepIndirectReferences(self.__external_references,
+                                          self._objects[idnum - 1])
+            self.__share_resources(self._objects[idnum - 1])
+        del self.stack
+
+    def flush(self, until=None):
+        """
+        Write the objects added since the last call, sweeping them first if
+        needed (see sweep).
+
+        :Parameters:
+          - `until` The number of the last object to write, or None to
+            write all of them. The input objects referenced by the written
+            objects are then written by a later call.
+        """
+        self.sweep(until)
+        while self.__next_written < self.__next_swept and \
+                (until is None or self.__next_written < until):
+            idnum = self.__next_written + 1
+            self.__next_written += 1
+            if idnum in self.__document_objects or \
+                    idnum in self.__free_objects:
+                continue
+            self.__write_object(idnum)
+
+    def close(self):
+        """
+        Write the remaining objects and end the document.
+
+        The underlying stream is not closed.
+        """
+        self.flush()
+        self.stack = []
+        self._sweepIndirectReferences(self.__external_references, self._root)
+        del self.stack
+        for idnum in range(1, len(self._objects) + 1):
+            if idnum not in self.__object_positions and \
+                    idnum not in self.__free_objects:
+                self.__write_object(idnum)
+
+        # Free objects are chained from object 0, each entry giving the
+        # number of the next free object
+        free_objects = sorted(self.__free_objects) + [0]
+        next_free = dict(zip([0] + free_objects[:-1], free_objects))
+        xref_location = self.__stream.tell()
+        self.__stream.write("xref\n")
+        self.__stream.write("0 %i\n" % (len(self._objects) + 1))
+        self.__stream.write("%010d %05d f \n" % (next_free[0], 65535))
+        for idnum in range(1, len(self._objects) + 1):
+            if idnum in next_free:
+                self.__stream.write("%010d %05d f \n" %
+                                    (next_free[idnum], 1))
+            else:
+                self.__stream.write("%010d %05d n \n" %
+                                    (self.__object_positions[idnum], 0))
+
+        self.__stream.write("trailer\n")
+        trailer = pyPdf.generic.DictionaryObject()
+        trailer.update({
+            pyPdf.generic.NameObject("/Size"):
+                pyPdf.generic.NumberObject(len(self._objects) + 1),
+            pyPdf.generic.NameObject("/Root"): self._root,
+            pyPdf.generic.NameObject("/Info"): self._info,
+            })
+        trailer.writeToStream(self.__stream, None)
+        self.__stream.write("\nstartxref\n%i\n%%%%EOF\n" % xref_location)
+
+########################################################################
+
+def _merge_sheet(inpdf, sheet, cancellation_token=None):
+    """
+    Build an output page by merging input pages.
+
+    The output page is returned in a serialized form, which does not depend
+    on the process it was built in.
+
+    :Parameters:
+      - `inpdf` The pyPdf.PdfFileReader of the input document.
+      - `sheet` A tuple (width, height, cells, collect_stats, level) where
+        cells is a list of tuples (page_number, matrix) describing the input
+        pages to put on the output page (see ImpositionPlan.get_cells),
+        collect_stats tells wether to measure the conversion phases, and
+        level is the zlib compression level of the content stream, or None
+        not to compress it.
+      - `cancellation_token` A CancellationToken checked before putting
+        each input page, or None.
+
+    :Returns:
+        A tuple (contents, resources, stats) where contents is the content
+        stream data of the output page, or None if it is blank, resources
+        is its resource dictionary written as in a PDF document, and stats
+        are the values of a _Stats.
+
+    :Raises UserInterruptError: if the cancellation token is cancelled.
+    """
+    width, height, cells, collect_stats, level = sheet
+    stats = _Stats(collect_stats)
+    page = pyPdf.pdf.PageObject.createBlankPage(None, width, height)
+    for page_number, matrix in cells:
+        if cancellation_token:
+            cancellation_token.check()
+        start = stats.start()
+        page2 = inpdf.getPage(page_number)
+        start = stats.stop("parse", start)
+        # pyPdf parses the content stream of page2 for each merge
+        page.mergeTransformedPage(page2, matrix)
+        stats.stop("merge", start)
+        stats.count("pages_parsed")
+        stats.count("cells_merged")
+    if page.has_key("/Contents"):
+        contents = page["/Contents"].getData()
+        if level is not None:
+            start = stats.start()
+            contents = zlib.compress(contents, level)
+            stats.stop("compress", start)
+            stats.count("bytes_compressed", len(contents))
+    else:
+        contents = None
+    resources = StringIO()
+    page["/Resources"].writeToStream(resources, None)
+    return contents, resources.getvalue(), stats.values
+
+_worker_inpdf = None
+"""The input document of a worker process"""
+
+def _init_merge_worker(input_data):
+    """
+    Initialize a worker process building output pages.
+
+    :Parameters:
+      - `input_data` The content of the input PDF document, or a mmap of
+        the input PDF file.
+    """
+    global _worker_inpdf
+    if isinstance(input_data, mmap.mmap):
+        _worker_inpdf = pyPdf.PdfFileReader(input_data)
+    else:
+        _worker_inpdf = pyPdf.PdfFileReader(StringIO(input_data))
+
+def _merge_worker_sheet(sheet):
+    """
+    Build an output page in a worker process (see _merge_sheet).
+    """
+    result = _merge_sheet(_worker_inpdf, sheet)
+    _release_objects(_worker_inpdf)
+    return result
+
+########################################################################
+
+class CancellationToken(object):
+    """
+    A request to stop a conversion, which can be made from another thread.
+
+    The conversion checks the token between steps, at most the time of
+    putting one input page on an output page apart, or
+    StreamConverter.CANCELLATION_POLL_INTERVAL apart while waiting for
+    worker processes, and raises UserInterruptError once it is cancelled
+    (see AbstractConverter.set_cancellation_token).
+    """
+    def __init__(self):
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Request the conversion to stop.
+        """
+        self.__cancelled.set()
+
+    def is_cancelled(self):
+        """
+        Tell wether the conversion was requested to stop.
+
+        :Returns:
+            True if cancel was called.
+        """
+        return self.__cancelled.is_set()
+
+    def check(self):
+        """
+        Stop the conversion if it was requested to.
+
+        :Raises UserInterruptError: if cancel was called.
+        """
+        if self.__cancelled.is_set():
+            raise UserInterruptError()
+
+class ProgressEvent(object):
+    """
+    The progress of a conversion, as given to progress listeners (see
+    AbstractConverter.set_progress_listener).
+
+    The attributes are:
+      - `phase` a constant from ProgressPhase;
+      - `done` the number of steps of the phase already done;
+      - `total` the number of steps of the phase;
+      - `elapsed` the time since the conversion started, in seconds.
+
+    The message describing the event is only built if get_message is
+    called.
+    """
+    __slots__ = ("phase", "done", "total", "elapsed")
+
+    def __init__(self, phase, done, total, elapsed):
+        self.phase = phase
+        self.done = done
+        self.total = total
+        self.elapsed = elapsed
+
+    def get_progress(self):
+        """
+        Return the progress of the phase.
+
+        :Returns:
+            A number in the range [0, 1].
+        """
+        if not self.total:
+            return 1.
+        return float(self.done) / self.total
+
+    def get_eta(self):
+        """
+        Estimate the remaining time of the phase.
+
+        :Returns:
+            The estimated remaining time in seconds, or None if it can not be
+            estimated yet.
+        """
+        if not self.done:
+            return None
+        return self.elapsed * (self.total - self.done) / self.done
+
+    def get_message(self):
+        """
+        Return a translated message describing the event.
+
+        :Returns:
+            A string.
+        """
+        # XXX: Translated progress messages
+        if self.phase == ProgressPhase.CREATE:
+            return _("creating page %i") % (self.done + 1)
+        elif self.phase == ProgressPhase.EXTRACT:
+            return _("extracting page %i") % (self.done + 1)
+        elif self.phase == ProgressPhase.WRITE:
+            return _("writing converted file")
+        else:
+            return _("done")
+
+class PageGeometry(object):
+    """
+    The boxes and rotation of all the pages of a document.
+
+    They are read once from the page dictionaries and kept in arrays, 4
+    numbers per box, so that the page dictionaries are not looked up again
+    while imposing. A PageGeometry can be pickled, e.g. to be read in
+    another process, and given to a converter of the same document (see
+    StreamConverter.set_page_geometry).
+    """
+    __slots__ = ("_media_boxes", "_crop_boxes", "_rotations")
+
+    def __init__(self, pdf):
+        """
+        Create a PageGeometry.
+
+        :Parameters:
+          - `pdf` The pyPdf.PdfFileReader of the document.
+        """
+        self._media_boxes = array.array("d")
+        self._crop_boxes = array.array("d")
+        self._rotations = array.array("h")
+        for page_number in xrange(pdf.getNumPages()):
+            page = pdf.getPage(page_number)
+            media_box = self.__read_box(page["/MediaBox"])
+            if page.has_key("/CropBox"):
+                crop_box = self.__read_box(page["/CropBox"])
+                # The crop box is clipped to the media box
+                crop_box = (max(crop_box[0], media_box[0]),
+                            max(crop_box[1], media_box[1]),
+                            min(crop_box[2], media_box[2]),
+                            min(crop_box[3], media_box[3]))
+            else:
+                crop_box = media_box
+            self._media_boxes.extend(media_box)
+            self._crop_boxes.extend(crop_box)
+            rotation = 0
+            if page.has_key("/Rotate"):
+                # Rotations which are not a multiple of 90 degrees are
+                # invalid
+                rotation = int(page["/Rotate"]) / 90 % 4 * 90
+            self._rotations.append(rotation)
+
+    @staticmethod
+    def __read_box(box):
+        """
+        Convert a PDF rectangle to a tuple (x0, y0, x1, y1) where x0 <= x1
+        and y0 <= y1.
+        """
+        x0, y0, x1, y1 = [float(value.getObject()) for value in box]
+        return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+    def __getstate__(self):
+        return self._media_boxes, self._crop_boxes, self._rotations
+
+    def __setstate__(self, state):
+        self._media_boxes, self._crop_boxes, self._rotations = state
+
+    def __len__(self):
+        return len(self._rotations)
+
+    def get_media_box(self, page_number):
+        """
+        Return the media box of a page.
+
+        :Returns:
+            A tuple (x0, y0, x1, y1).
+        """
+        return tuple(self._media_boxes[4 * page_number:4 * page_number + 4])
+
+    def get_crop_box(self, page_number):
+        """
+        Return the crop box of a page, which is the media box if the page
+        has none.
+
+        :Returns:
+            A tuple (x0, y0, x1, y1).
+        """
+        return tuple(self._crop_boxes[4 * page_number:4 * page_number + 4])
+
+    def get_rotation(self, page_number):
+        """
+        Return the rotation of a page.
+
+        :Returns:
+            0, 90, 180 or 270 degrees clockwise.
+        """
+        return self._rotations[page_number]
+
+    def get_size(self, page_number):
+        """
+        Return the size of a page as it is displayed.
+
+        :Returns:
+            A tuple (width, height), the dimensions of the media box being
+            swapped if the page is rotated by 90 or 270 degrees.
+        """
+        x0, y0, x1, y1 = self.get_media_box(page_number)
+        if self._rotations[page_number] in (90, 270):
+            return y1 - y0, x1 - x0
+        return x1 - x0, y1 - y0
+
+    def fit_matrix(self, page_number, matrix, size):
+        """
+        Adapt the transformation matrix of a slot to a page.
+
+        The matrices of a plan are computed for pages of a given size whose
+        lower left corner is at the origin. The page is first rotated as it
+        is displayed, moved to the origin, scaled to fit in that size and
+        centered.
+
+        :Parameters:
+          - `page_number` The number of the page.
+          - `matrix` The transformation matrix of the slot.
+          - `size` A tuple (width, height) representing the size of the
+            pages the matrix was computed for.
+
+        :Returns:
+            The transformation matrix to apply to the page, which is matrix
+            itself if the page already has that size.
+        """
+        x0, y0, x1, y1 = self.get_media_box(page_number)
+        rotation = self._rotations[page_number]
+        width, height = self.get_size(page_number)
+        if (x0, y0, rotation) == (0, 0, 0) and (width, height) == size:
+            return matrix
+        if width <= 0 or height <= 0:
+            return matrix
+
+        fit = (1, 0, 0, 1, -x0, -y0)
+        if rotation == 90:
+            fit = _multiply_matrices(fit, (0, -1, 1, 0, 0, x1 - x0))
+        elif rotation == 180:
+            fit = _multiply_matrices(fit, (-1, 0, 0, -1, x1 - x0, y1 - y0))
+        elif rotation == 270:
+            fit = _multiply_matrices(fit, (0, 1, -1, 0, y1 - y0, 0))
+        scale = min(size[0] / width, size[1] / height)
+        fit = _multiply_matrices(fit, (scale, 0, 0, scale,
+                                       (size[0] - width * scale) / 2,
+                                       (size[1] - height * scale) / 2))
+        return _multiply_matrices(fit, matrix)
+
+class ImpositionPlan(object):
+    """
+    The placement of input pages on output pages for one conversion.
+
+    A plan is computed once from the settings of a converter (see
+    AbstractConverter.get_plan). Each output page (sheet) is divided in
+    slots, each slot having its own transformation matrix, and each slot
+    of each sheet is assigned an input page or nothing. A plan only depends
+    on the settings and on the number and size of the input pages, so it
+    can be serialized (see to_dict) and reused for another document with
+    the same characteristics.
+    """
+    __slots__ = ("_conversion", "_output_size", "_matrices", "_pages")
+
+    def __init__(self, conversion, output_size, matrices, pages):
+        """
+        Create an ImpositionPlan.
+
+        :Parameters:
+          - `conversion` A constant from Conversion.
+          - `output_size` A tuple (width, height) representing the size of
+            the output pages expressed in default user space units.
+          - `matrices` A sequence of transformation matrices, one per slot,
+            each being a sequence of 6 numbers.
+          - `pages` A sequence of the input page numbers assigned to each
+            slot of each sheet, sheet after sheet. None or -1 means an empty
+            slot.
+        """
+        assert conversion in (Conversion.BOOKLETIZE, Conversion.LINEARIZE,
+                              Conversion.REDUCE)
+        assert len(pages) % len(matrices) == 0
+        self._conversion = conversion
+        self._output_size = tuple(output_size)
+        self._matrices = tuple([tuple(matrix) for matrix in matrices])
+        if isinstance(pages, array.array):
+            self._pages = pages
+        else:
+            self._pages = array.array("l", [
+                page is None and -1 or page for page in pages])
+
+    @staticmethod
+    def __get_page(page):
+        """
+        Convert a stored page number to None if the slot is empty.
+        """
+        if page == -1:
+            return None
+        return page
+
+    def get_conversion(self):
+        """
+        Return the conversion this plan was computed for.
+
+        :Returns:
+            A constant from Conversion.
+        """
+        return self._conversion
+
+    def get_output_size(self):
+        """
+        Return the size of the output pages.
+
+        :Returns:
+            A tuple (width, height) expressed in default user space units.
+        """
+        return self._output_size
+
+    def get_slot_count(self):
+        """
+        Return the number of slots of an output page.
+
+        :Returns:
+            The number of slots of an output page.
+        """
+        return len(self._matrices)
+
+    def get_matrix(self, slot):
+        """
+        Return the transformation matrix of a slot.
+
+        :Parameters:
+          - `slot` The number of the slot.
+
+        :Returns:
+            A tuple of 6 numbers to apply to the input page put in that slot.
+        """
+        return self._matrices[slot]
+
+    def get_sheet_count(self):
+        """
+        Return the number of output pages.
+
+        :Returns:
+            The number of output pages.
+        """
+        return len(self._pages) / len(self._matrices)
+
+    def get_sheet(self, sheet):
+        """
+        Return the input pages assigned to each slot of an output page.
+
+        :Parameters:
+          - `sheet` The number of the output page.
+
+        :Returns:
+            A list of input page numbers, one per slot, containing None for
+            empty slots.
+        """
+        start = sheet * len(self._matrices)
+        return [self.__get_page(page) for page in
+                self._pages[start:start + len(self._matrices)]]
+
+    def get_cells(self, sheet):
+        """
+        Return the input pages to put on an output page.
+
+        :Parameters:
+          - `sheet` The number of the output page.
+
+        :Returns:
+            A list of tuples (page_number, matrix) for the non empty slots
+            of the output page.
+        """
+        start = sheet * len(self._matrices)
+        return [(self._pages[start + slot], matrix)
+                for slot, matrix in enumerate(self._matrices)
+                if self._pages[start + slot] != -1]
+
+    def select_sheets(self, first, last):
+        """
+        Restrict the plan to some output pages.
+
+        :Parameters:
+          - `first` The number of the first output page to keep.
+          - `last` The number of the last output page to keep.
+
+        :Returns:
+            An ImpositionPlan containing output pages first to last.
+        """
+        assert 0 <= first <= last < self.get_sheet_count()
+        return ImpositionPlan(self._conversion, self._output_size,
+                              self._matrices,
+                              self._pages[first * len(self._matrices):
+                                          (last + 1) * len(self._matrices)])
+
+    def to_dict(self):
+        """
+        Serialize the plan.
+
+        :Returns:
+            A dictionnary only containing strings, numbers, None and lists,
+            which can be given to from_dict.
+        """
+        return {
+            "conversion": self._conversion,
+            "output_size": list(self._output_size),
+            "matrices": [list(matrix) for matrix in self._matrices],
+            "sheets": [self.get_sheet(sheet)
+                       for sheet in xrange(self.get_sheet_count())],
+            }
+
+    @staticmethod
+    def from_dict(data):
+        """
+        Unserialize a plan.
+
+        :Parameters:
+          - `data` A dictionnary returned by to_dict.
+
+        :Returns:
+            An ImpositionPlan.
+        """
+        pages = []
+        for sheet in data["sheets"]:
+            pages.extend(sheet)
+        return ImpositionPlan(data["conversion"], data["output_size"],
+                              data["matrices"], pages)
+
+class ResultCache(object):
+    """
+    An on-disk cache of converted documents.
+
+    Each result is stored in a file named after a digest of the content of
+    the input document, of the conversion settings and of the version of
+    this module. When the cache grows beyond its size limit, the least
+    recently used results are removed.
+
+    The cache can be shared by several processes.
+    """
+    BLOCK_SIZE = 1024 * 1024
+    """The size of the blocks in which files are read, in bytes"""
+
+    def __init__(self, directory, max_size=256 * 1024 * 1024):
+        """
+        Create a ResultCache.
+
+        :Parameters:
+          - `directory` The directory where results are stored. It is
+            created if it does not exist.
+          - `max_size` The maximum total size of the results, in bytes.
+        """
+        assert int(max_size) >= 0
+        self.__directory = directory
+        self.__max_size = int(max_size)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_directory(self):
+        """
+        Get the directory where results are stored.
+        """
+        return self.__directory
+
+    def get_max_size(self):
+        """
+        Get the maximum total size of the results, in bytes.
+        """
+        return self.__max_size
+
+    def get_key(self, input_stream, settings):
+        """
+        Compute the key of a result.
+
+        :Parameters:
+          - `input_stream` The file-like object from which the input PDF
+            document is read. It is read entirely, then rewinded.
+          - `settings` A dictionnary of the settings the result depends on.
+
+        :Returns:
+            A string.
+        """
+        digest = hashlib.sha1()
+        input_stream.seek(0)
+        while True:
+            data = input_stream.read(self.BLOCK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+        input_stream.seek(0)
+        digest.update(repr(sorted(settings.items())))
+        digest.update(__version__)
+        return digest.hexdigest()
+
+    def __get_path(self, key):
+        return os.path.join(self.__directory, key + ".pdf")
+
+    def open(self, key):
+        """
+        Open a result and mark it as recently used.
+
+        :Parameters:
+          - `key` The key of the result (see get_key).
+
+        :Returns:
+            A file object open for reading, or None if there is no such
+            result.
+        """
+        try:
+            result = open(self.__get_path(key), 'rb')
+            os.utime(self.__get_path(key), None)
+        except (IOError, OSError):
+            return None
+        return result
+
+    def store(self, key, filename):
+        """
+        Copy a converted document into the cache, then remove the least
+        recently used results if the cache is too large.
+
+        :Parameters:
+          - `key` The key of the result (see get_key).
+          - `filename` The name of the converted document.
+        """
+        if os.path.getsize(filename) <= self.__max_size:
+            descriptor, temporary_name = tempfile.mkstemp(".tmp", ".",
+                                                          self.__directory)
+            os.close(descriptor)
+            try:
+                shutil.copyfile(filename, temporary_name)
+                _replace_file(temporary_name, self.__get_path(key))
+            except:
+                os.remove(temporary_name)
+                raise
+        self.__evict()
+
+    def __evict(self):
+        """
+        Remove the least recently used results until the cache fits its
+        size limit.
+        """
+        results = []
+        for name in os.listdir(self.__directory):
+            if not name.endswith(".pdf"):
+                continue
+            try:
+                status = os.stat(os.path.join(self.__directory, name))
+            except OSError:
+                # Removed by another process
+                continue
+            results.append((status.st_mtime, status.st_size, name))
+        results.sort()
+        size = sum([result[1] for result in results])
+        for mtime, result_size, name in results:
+            if size <= self.__max_size:
+                break
+            try:
+                os.remove(os.path.join(self.__directory, name))
+            except OSError:
+                pass
+            size -= result_size
+
+    def clear(self):
+        """
+        Remove all the results.
+        """
+        for name in os.listdir(self.__directory):
+            if name.endswith(".pdf"):
+                os.remove(os.path.join(self.__directory, name))
 
 ########################################################################
 
@@ -149,10 +1351,12 @@ class AbstractConverter(object):
         "A5":(420,595), 
         }
 
-    def __init__(self, 
+    def __init__(self,
                  layout='2x1',
                  format='A4',
-                 copy_pages=False):
+                 copy_pages=False,
+                 placement_engine=PlacementEngine.MERGE,
+                 jobs=1):
         """
         Create an AbstractConverter instance.
 
@@ -164,6 +1368,10 @@ class AbstractConverter(object):
           - `copy_pages` Wether the same group of input pages
             shoud be copied to fill the corresponding output page or not
             (see set_copy_pages).
+          - `placement_engine` The way input pages are put on output
+            pages (see set_placement_engine).
+          - `jobs` The number of processes building output pages (see
+            set_jobs).
         """
         self.layout = None
         self.output_format = None
@@ -172,110 +1380,289 @@ class AbstractConverter(object):
         self.set_layout(layout)
         self.set_output_format(format)
         self.set_copy_pages(copy_pages)
+        self.set_placement_engine(placement_engine)
+        self.set_jobs(jobs)
+
+        def default_progress_callback(msg, prog):
+            print "%s (%i%%)" % (msg, prog*100)
+
+        self.set_progress_callback(default_progress_callback)
+        self.set_progress_frequency(10)
+        self.__progress_start = time.time()
+        self.__next_progress = 0
+        self.set_cancellation_token(CancellationToken())
+        self.set_compression_profile(CompressionProfile.DEFAULT)
+        self.set_compression_threads(multiprocessing.cpu_count())
+        self.set_page_range(None)
+        self.set_sheet_range(None)
+
+    # GETTERS AND SETTERS
+    # ===================
+
+    def set_output_height(self, height):
+        """
+        Set the height of the output page.
+
+        :Parameters:
+          - `height` The height of the output page in defalut user
+            space units.
+        """
+        self.__output_height = int(height)
+
+    def get_output_height(self):
+        """
+        Get the height of the output page.
+
+        :Returns:
+            The height of the output page in defalut user space units.
+        """
+        return self.__output_height
+
+    def set_output_width(self, width):
+        """
+        Set the width of the output page.
+
+          - `width` The height of the output page in defalut user space units.
+        """
+        self.__output_width = int(width)
+
+    def get_output_width(self):
+        """
+        Get the width of the output page.
+
+        :Returns:
+            The width of the output page in defalut user space units.
+        """
+        return self.__output_width
+
+    def set_pages_in_width(self, num):
+        """
+        Set the number of input pages to put in the width on one output page.
+
+        :Parameters:
+          - `num` An integer representing the number of pages in width.
+        """
+        self.__pages_in_width = int(num)
+
+    def get_pages_in_width(self):
+        """
+        Get the number of input pages to put in the width on one output page.
+
+        :Returns:
+            An integer representing the number of pages in width.
+        """
+        return self.__pages_in_width
+
+    def set_pages_in_height(self, num):
+        """
+        Set the number of input pages to put in the height on one output page.
+
+        :Parameters:
+          - `num` An integer representing the number of pages in height.
+        """
+        self.__pages_in_height = int(num)
+
+    def get_pages_in_height(self):
+        """
+        Get the number of input pages to put in the height on one output page.
+
+        :Returns:
+            An integer representing the number of pages in height.
+        """
+        return self.__pages_in_height
+
+    def set_copy_pages(self, copy_pages):
+        """
+        Set wether the same group of input pages shoud be copied to fill the
+        corresponding output page or not.
+
+        :Parameters:
+          - `copy_pages` True to get copies of the same group of input page
+            on one output page. False to get diffrent groups of
+            input pages on one output page.
+        """
+        self.__copy_pages = bool(copy_pages)
+
+    def get_copy_pages(self):
+        """
+        Get wether the same group of input pages will be copied to fill the
+        corresponding output page or not.
+
+        :Returns:
+            True if copies of the same group of input page will get
+            copied on one output page. False if diffrent groups of
+            input pages will go on one output page.
+        """
+        return self.__copy_pages
+
+    def set_placement_engine(self, placement_engine):
+        """
+        Set the way input pages are put on output pages.
+
+        With PlacementEngine.MERGE, the content stream of each input page
+        is copied into every output page it appears on. With
+        PlacementEngine.XOBJECT, each input page is wrapped once in a Form
+        XObject which output pages draw, so its content is written only
+        once whatever the number of output pages referencing it. With
+        PlacementEngine.FAST_MERGE, the input content streams are referenced
+        as they are, between graphics state operators setting the
+        transformation matrix; they are parsed only if resource names
+        clash and need renaming.
+
+        Linearization always draws input pages through Form XObjects
+        clipped to the part shown on each output page, whatever the
+        placement engine.
 
-        def default_progress_callback(msg, prog):
-            print "%s (%i%%)" % (msg, prog*100)
+        :Parameters:
+          - `placement_engine` A constant from PlacementEngine.
+        """
+        assert(placement_engine == PlacementEngine.MERGE or \
+               placement_engine == PlacementEngine.XOBJECT or \
+               placement_engine == PlacementEngine.FAST_MERGE)
+        self.__placement_engine = placement_engine
 
-        self.set_progress_callback(default_progress_callback)
+    def get_placement_engine(self):
+        """
+        Get the way input pages are put on output pages.
 
-    # GETTERS AND SETTERS
-    # ===================
+        :Returns:
+            A constant from PlacementEngine.
+        """
+        return self.__placement_engine
 
-    def set_output_height(self, height):
+    def set_jobs(self, jobs):
         """
-        Set the height of the output page.
+        Set the number of processes building output pages.
+
+        Only the PlacementEngine.MERGE placement engine, which parses the
+        content of every input page, distributes output pages among worker
+        processes. The output document is the same whatever the number of
+        processes.
 
         :Parameters:
-          - `height` The height of the output page in defalut user
-            space units.
+          - `jobs` A strictly positive integer.
         """
-        self.__output_height = int(height)
+        assert(int(jobs) >= 1)
+        self.__jobs = int(jobs)
 
-    def get_output_height(self):
+    def get_jobs(self):
         """
-        Get the height of the output page.
+        Get the number of processes building output pages.
 
         :Returns:
-            The height of the output page in defalut user space units.
+            A strictly positive integer.
         """
-        return self.__output_height
+        return self.__jobs
 
-    def set_output_width(self, width):
+    def set_compression_profile(self, compression_profile):
         """
-        Set the width of the output page.
+        Set how much the content streams built by the converter are
+        compressed.
 
-          - `width` The height of the output page in defalut user space units.
+        Input content streams which are copied as they are keep their
+        compression.
+
+        :Parameters:
+          - `compression_profile` A constant from CompressionProfile.
         """
-        self.__output_width = int(width)
+        assert(compression_profile in _compression_levels)
+        self.__compression_profile = compression_profile
 
-    def get_output_width(self):
+    def get_compression_profile(self):
         """
-        Get the width of the output page.
+        Get how much the content streams built by the converter are
+        compressed.
 
         :Returns:
-            The width of the output page in defalut user space units.
+            A constant from CompressionProfile.
         """
-        return self.__output_width
+        return self.__compression_profile
 
-    def set_pages_in_width(self, num):
+    def set_compression_threads(self, threads):
         """
-        Set the number of input pages to put in the width on one output page.
+        Set the number of threads compressing content streams while the
+        next output pages are built.
+
+        With a single thread, content streams are compressed as soon as
+        they are built, in the thread running the conversion. Worker
+        processes (see set_jobs) compress the output pages they build
+        themselves.
 
         :Parameters:
-          - `num` An integer representing the number of pages in width.
+          - `threads` A strictly positive integer. It defaults to the
+            number of processors.
         """
-        self.__pages_in_width = int(num)
+        assert(int(threads) >= 1)
+        self.__compression_threads = int(threads)
 
-    def get_pages_in_width(self):
+    def get_compression_threads(self):
         """
-        Get the number of input pages to put in the width on one output page.
+        Get the number of threads compressing content streams.
 
         :Returns:
-            An integer representing the number of pages in width.
+            A strictly positive integer.
         """
-        return self.__pages_in_width
+        return self.__compression_threads
 
-    def set_pages_in_height(self, num):
+    def set_page_range(self, page_range):
         """
-        Set the number of input pages to put in the height on one output page.
+        Set the input pages to convert.
+
+        The conversion is performed as if the input document only contained
+        these pages, e.g. a booklet is made of them only.
 
         :Parameters:
-          - `num` An integer representing the number of pages in height.
+          - `page_range` A tuple (first, last) representing the numbers
+            of the first and last input pages to convert, starting from 0,
+            or None to convert all of them. The range is cut at the last
+            page of the document.
         """
-        self.__pages_in_height = int(num)
+        if page_range is not None:
+            first, last = page_range
+            assert 0 <= int(first) <= int(last)
+            page_range = (int(first), int(last))
+        self.__page_range = page_range
 
-    def get_pages_in_height(self):
+    def get_page_range(self):
         """
-        Get the number of input pages to put in the height on one output page.
+        Get the input pages to convert.
 
         :Returns:
-            An integer representing the number of pages in height.
+            A tuple (first, last) of input page numbers, or None if all of
+            them are converted.
         """
-        return self.__pages_in_height
+        return self.__page_range
 
-    def set_copy_pages(self, copy_pages):
+    def set_sheet_range(self, sheet_range):
         """
-        Set wether the same group of input pages shoud be copied to fill the
-        corresponding output page or not.
+        Set the output pages to build.
+
+        The placement of input pages is computed for the whole conversion
+        (see set_page_range), then only the given output pages are built,
+        e.g. to print a proof of the first sheets of a booklet. Only the
+        input pages put on them are read.
 
         :Parameters:
-          - `copy_pages` True to get copies of the same group of input page
-            on one output page. False to get diffrent groups of
-            input pages on one output page.
+          - `sheet_range` A tuple (first, last) representing the numbers of
+            the first and last output pages to build, starting from 0, or
+            None to build all of them. The range is cut at the last output
+            page.
         """
-        self.__copy_pages = bool(copy_pages)
+        if sheet_range is not None:
+            first, last = sheet_range
+            assert 0 <= int(first) <= int(last)
+            sheet_range = (int(first), int(last))
+        self.__sheet_range = sheet_range
 
-    def get_copy_pages(self):
+    def get_sheet_range(self):
         """
-        Get wether the same group of input pages will be copied to fill the
-        corresponding output page or not.
+        Get the output pages to build.
 
         :Returns:
-            True if copies of the same group of input page will get
-            copied on one output page. False if diffrent groups of
-            input pages will go on one output page.
+            A tuple (first, last) of output page numbers, or None if all of
+            them are built.
         """
-        return self.__copy_pages
+        return self.__sheet_range
 
     def set_progress_callback(self, progress_callback):
         """
@@ -293,6 +1680,10 @@ class AbstractConverter(object):
         assert(type(progress_callback) is types.FunctionType)
         self.__progress_callback = progress_callback
 
+        def progress_listener(event):
+            progress_callback(event.get_message(), event.get_progress())
+        self.__progress_listener = progress_listener
+
     def get_progress_callback(self):
         """
         Get the progress callback function.
@@ -306,6 +1697,99 @@ class AbstractConverter(object):
         """
         return self.__progress_callback
 
+    def set_progress_listener(self, progress_listener):
+        """
+        Register a progress listener.
+
+        The listener receives structured events instead of messages, and
+        replaces the progress callback (see set_progress_callback).
+
+        :Parameters:
+          - `progress_listener` A callable which is called to return the
+            conversion progress. It takes a ProgressEvent.
+        """
+        assert(callable(progress_listener))
+        self.__progress_listener = progress_listener
+
+    def get_progress_listener(self):
+        """
+        Get the progress listener.
+
+        :Returns:
+            The callable which is called with a ProgressEvent to return the
+            conversion progress.
+        """
+        return self.__progress_listener
+
+    def set_progress_frequency(self, frequency):
+        """
+        Set the maximum number of progress events per second.
+
+        Events exceeding that rate are dropped, except the first and the
+        last one of each phase.
+
+        :Parameters:
+          - `frequency` A number of events per second.
+        """
+        assert(frequency > 0)
+        self.__progress_frequency = frequency
+
+    def get_progress_frequency(self):
+        """
+        Get the maximum number of progress events per second.
+
+        :Returns:
+            A number of events per second.
+        """
+        return self.__progress_frequency
+
+    def set_cancellation_token(self, cancellation_token):
+        """
+        Set the token which stops the conversion when it is cancelled.
+
+        Once the token is cancelled, the conversion stops as soon as
+        possible, the partial output is discarded and UserInterruptError is
+        raised.
+
+        :Parameters:
+          - `cancellation_token` A CancellationToken.
+        """
+        assert(isinstance(cancellation_token, CancellationToken))
+        self.__cancellation_token = cancellation_token
+
+    def get_cancellation_token(self):
+        """
+        Get the token which stops the conversion when it is cancelled.
+
+        :Returns:
+            A CancellationToken.
+        """
+        return self.__cancellation_token
+
+    def _start_progress(self):
+        """
+        Start measuring the time elapsed in the conversion.
+        """
+        self.__progress_start = time.time()
+        self.__next_progress = 0
+
+    def _report_progress(self, phase, done, total):
+        """
+        Send a progress event to the progress listener, unless too many
+        events were already sent recently (see set_progress_frequency).
+
+        :Parameters:
+          - `phase` A constant from ProgressPhase.
+          - `done` The number of steps of the phase already done.
+          - `total` The number of steps of the phase.
+        """
+        now = time.time()
+        if now < self.__next_progress and 0 < done < total:
+            return
+        self.__next_progress = now + 1. / self.__progress_frequency
+        self.__progress_listener(ProgressEvent(phase, done, total,
+                                               now - self.__progress_start))
+
     # SOME GETTERS THAT CALCULATE THE VALUE THEY RETURN FROM OTHER VALUES
     # ===================================================================
     def get_input_size(self):
@@ -483,31 +1967,376 @@ class AbstractConverter(object):
         """
         output_orientation = bool(output_orientation)
 
-        w = self.get_output_width()
-        h = self.get_output_height()
+        w = self.get_output_width()
+        h = self.get_output_height()
+
+        if (output_orientation == PageOrientation.PORTRAIT and w > h) or \
+           (output_orientation == PageOrientation.LANDSCAPE and h > w):
+            self.set_output_height(w)
+            self.set_output_width(h)
+
+    def _get_output_orientation(self):
+        """
+        Return the orientation of the output paper.
+
+        WARNING: in the current implementation, the orientation of the
+        output paper may be automatically adjusted, even if it was set
+        manually.
+
+        :Returns:
+            A constant among from PageOrientation, or None (if square paper).
+        """
+        if self.get_output_height() > self.get_output_width():
+            return PageOrientation.PORTRAIT
+        elif self.get_output_height() < self.get_output_width():
+            return PageOrientation.LANDSCAPE
+        else:
+            return None
+
+    def __fix_page_orientation(self, cmp):
+        """
+        Adapt the output page orientation.
+
+        :Parameters:
+          - `cmp` A comparator function. Takes: number of pages on one
+            direction (int), number of pages on the other direction
+            (int). Must return: the boolean result of the comparaison.
+
+        :Raises MismachingOrientationsError: if the required layout is
+            incompatible with the input page orientation.
+        """
+        if cmp(self.get_pages_in_width(), self.get_pages_in_height()):
+            if self.get_input_orientation() == PageOrientation.PORTRAIT:
+                if self._get_output_orientation() == PageOrientation.PORTRAIT:
+                    self._set_output_orientation(PageOrientation.LANDSCAPE)
+            else:
+                raise MismachingOrientationsError(self.get_layout())
+        elif cmp(self.get_pages_in_height(), self.get_pages_in_width()):
+            if self.get_input_orientation() == PageOrientation.LANDSCAPE:
+                if self._get_output_orientation() == PageOrientation.LANDSCAPE:
+                    self._set_output_orientation(PageOrientation.PORTRAIT)
+            else:
+                raise MismachingOrientationsError(self.get_layout())
+        else:
+            if self.get_input_orientation() == PageOrientation.LANDSCAPE:
+                if self._get_output_orientation() == PageOrientation.PORTRAIT:
+                    self._set_output_orientation(PageOrientation.LANDSCAPE)
+            else:
+                if self._get_output_orientation() == PageOrientation.LANDSCAPE:
+                    self._set_output_orientation(PageOrientation.PORTRAIT)
+
+    def __fix_page_orientation_for_booklet(self):
+        """
+        Adapt the output page orientation to impose
+        """
+        def __is_two_times(op1, op2):
+            if op1 == 2 * op2:
+                return True
+            else:
+                return False
+        self.__fix_page_orientation(__is_two_times)
+
+    def __fix_page_orientation_for_linearize(self):
+        """
+        Adapt the output page orientation to linearize
+        """
+        def __is_half(op1, op2):
+            if op2 == 2 * op1:
+                return True
+            else:
+                return False
+        self.__fix_page_orientation(__is_half)
+
+    def __get_pages_to_convert(self):
+        """
+        Get the input pages to convert (see set_page_range).
+
+        :Returns:
+            A tuple (first, count) representing the number of the first
+            input page to convert and the number of pages to convert.
+
+        :Raises InvalidRangeError: if the page range does not contain any
+            page of the input document.
+        """
+        n_pages = self.get_page_count()
+        if self.get_page_range() is None:
+            return 0, n_pages
+        first, last = self.get_page_range()
+        if first >= n_pages:
+            raise InvalidRangeError(self.get_page_range())
+        return first, min(last + 1, n_pages) - first
+
+    def __get_sequence_for_booklet(self):
+        """
+        Calculates the page sequence to impose a booklet.
+
+        The item at position p of the sequence goes in slot
+        p % pages_in_sheet of side (p / pages_in_sheet) % 2 of sheet
+        p / pages_in_sheet / 2. Items are computed when accessed.
+
+        :Returns:
+            A sequence of page numbers representing sequence of pages to
+            impose a booklet. The sequence might contain None where blank
+            pages should be added.
+        """
+        n_pages = self.__get_pages_to_convert()[1]
+
+        # Add reference to the missing empty pages to the pages sequence
+        # XXX: print a warning if input page number not diviable by 4?
+        n_booklet_pages = n_pages + (-n_pages % 4)
+
+        # Each pair of pages is copied if needed
+        if self.get_copy_pages():
+            n_copies = self.get_pages_in_sheet() / 2
+        else:
+            n_copies = 1
+
+        def get_page(position):
+            # Arranges the pages in booklet order: the pairs are
+            # [last, first], [first, last] of the remaining pages
+            pair = position / (2 * n_copies)
+            member = position % 2
+            fold, side = divmod(pair, 2)
+            if side == 0:
+                page = (n_booklet_pages - 1 - 2 * fold, 2 * fold)[member]
+            else:
+                page = (2 * fold + 1, n_booklet_pages - 2 - 2 * fold)[member]
+            if page < n_pages:
+                return page
+            else:
+                return None
+
+        return _LazySequence(n_booklet_pages * n_copies, get_page)
+
+    def __get_sequence_for_linearize(self, booklet=True):
+        """
+        Calculates the page sequence to lineraize a booklet.
+
+        The item at position p of the sequence corresponds to slot
+        p % pages_in_sheet of input page p / pages_in_sheet. Items are
+        computed when accessed.
+
+        :Returns:
+            A sequence of page numbers representing sequence of pages to
+            be extracted to linearize a booklet.
+        """
+        # XXX: is booklet argument useful?
+        n_slots = self.__get_pages_to_convert()[1] * self.get_pages_in_sheet()
+
+        if not booklet:
+            return _LazySequence(n_slots, lambda position: position)
+
+        # Each pair of pages is followed by blank slots if the input pages
+        # were copied
+        if self.get_copy_pages():
+            pair_length = max(2, self.get_pages_in_sheet())
+        else:
+            pair_length = 2
+
+        def get_page(position):
+            pair, member = divmod(position, pair_length)
+            if member >= 2:
+                return None
+            fold, side = divmod(pair, 2)
+            if side == 0:
+                return 2 * fold
+            else:
+                return 2 * fold + 1 + member
+
+        return _LazySequence(n_slots, get_page)
+
+    def __get_sequence_for_reduce(self):
+        """
+        Calculates the page sequence to linearly impose reduced pages.
+
+        The item at position p of the sequence goes in slot
+        p % pages_in_sheet of output page p / pages_in_sheet. Items are
+        computed when accessed.
+
+        :Returns:
+            A sequence of page numbers representing sequence of pages to
+            impose reduced pages. The sequence might contain None where blank
+            pages should be added.
+        """
+        n_pages = self.__get_pages_to_convert()[1]
+        pages_in_sheet = self.get_pages_in_sheet()
+        if self.get_copy_pages():
+            return _LazySequence(n_pages * pages_in_sheet,
+                                 lambda position: position / pages_in_sheet)
+        else:
+            def get_page(position):
+                if position < n_pages:
+                    return position
+                else:
+                    return None
+            return _LazySequence(n_pages + (-n_pages % pages_in_sheet),
+                                 get_page)
+
+    def __get_plan_for_reduce(self, conversion, sequence):
+        """
+        Calculate the plan to put reduced input pages on output pages.
+
+        :Parameters:
+          - `conversion` A constant from Conversion.
+          - `sequence` A sequence of page numbers representing the sequence
+            of pages to impose. None means blank page.
+
+        :Returns:
+            An ImpositionPlan.
+        """
+        width = self.get_output_width()
+        height = self.get_output_height()
+        pages_in_width = self.get_pages_in_width()
+        pages_in_height = self.get_pages_in_height()
+        factor = self.get_reduction_factor()
+
+        matrices = []
+        for vert_pos in range(0, pages_in_height):
+            for horiz_pos in range(0, pages_in_width):
+                matrices.append((factor, 0, 0, factor,
+                    horiz_pos * width / pages_in_width,
+                    height - (vert_pos + 1) * height / pages_in_height))
+
+        first_page = self.__get_pages_to_convert()[0]
+        pages = array.array("l", [-1]) * \
+            (len(sequence) + (-len(sequence) % len(matrices)))
+        for position, page in enumerate(sequence):
+            if page is not None:
+                pages[position] = first_page + page
+        return ImpositionPlan(conversion, (width, height), matrices, pages)
+
+    def __get_plan_for_linearize(self):
+        """
+        Calculate the plan to extract the pages of a booklet.
+
+        Each output page shows one slot of one input page, enlarged to
+        fill it.
+
+        :Returns:
+            An ImpositionPlan.
+        """
+        width = self.get_output_width()
+        height = self.get_output_height()
+        pages_in_width = self.get_pages_in_width()
+        pages_in_height = self.get_pages_in_height()
+        pages_in_sheet = self.get_pages_in_sheet()
+        factor = self.get_increasing_factor()
+
+        matrices = []
+        for vert_pos in range(0, pages_in_height):
+            for horiz_pos in range(0, pages_in_width):
+                matrices.append((factor, 0, 0, factor,
+                    - horiz_pos * width,
+                    (vert_pos - pages_in_height + 1) * height))
+
+        # The sequence gives the position where each extracted slot is
+        # inserted among the already extracted ones. Slots are inserted four
+        # by four in the middle of the previous ones: with k = n / 4, the
+        # n-th extracted slot ends up at position 2k if n = 4k + 1, 2k + 1
+        # if n = 4k + 2, and counting from the end, 2k + 1 if n = 4k + 3 and
+        # 2k if n = 4k.
+        sequence = self.__get_sequence_for_linearize()
+        # The first two slots of each pair are extracted, the others are
+        # the blank copies (see __get_sequence_for_linearize)
+        if self.get_copy_pages():
+            pair_length = max(2, pages_in_sheet)
+        else:
+            pair_length = 2
+        pairs, rest = divmod(len(sequence), pair_length)
+        extracted_count = 2 * pairs + min(rest, 2)
+
+        first_page = self.__get_pages_to_convert()[0]
+        pages = array.array("l", [-1]) * (extracted_count * pages_in_sheet)
+        extracted = 0
+        for position, output_page in enumerate(sequence):
+            if output_page is None:
+                continue
+            fold, member = divmod(extracted, 4)
+            if member == 0:
+                sheet = extracted_count - 2 * fold - 1
+            elif member == 3:
+                sheet = extracted_count - 2 * fold - 2
+            else:
+                sheet = 2 * fold + member - 1
+            input_page, slot = divmod(position, pages_in_sheet)
+            pages[sheet * pages_in_sheet + slot] = first_page + input_page
+            extracted += 1
+        return ImpositionPlan(Conversion.LINEARIZE, (width, height),
+                              matrices, pages)
+
+    def get_plan(self, conversion):
+        """
+        Calculate the placement of input pages on output pages.
+
+        The output page orientation is adapted to the conversion. Only the
+        input pages and output pages selected by set_page_range and
+        set_sheet_range are part of the plan.
 
-        if (output_orientation == PageOrientation.PORTRAIT and w > h) or \
-           (output_orientation == PageOrientation.LANDSCAPE and h > w):
-            self.set_output_height(w)
-            self.set_output_width(h)
+        :Parameters:
+          - `conversion` A constant from Conversion.
 
-    def _get_output_orientation(self):
+        :Returns:
+            An ImpositionPlan.
+
+        :Raises MismachingOrientationsError: if the required layout is
+            incompatible with the input page orientation.
+        :Raises InvalidRangeError: if the page range or the sheet range
+            does not contain any page.
+        """
+        if conversion == Conversion.BOOKLETIZE:
+            self.__fix_page_orientation_for_booklet()
+            plan = self.__get_plan_for_reduce(
+                conversion, self.__get_sequence_for_booklet())
+        elif conversion == Conversion.REDUCE:
+            self.__fix_page_orientation_for_booklet()
+            plan = self.__get_plan_for_reduce(
+                conversion, self.__get_sequence_for_reduce())
+        else:
+            assert conversion == Conversion.LINEARIZE
+            self.__fix_page_orientation_for_linearize()
+            plan = self.__get_plan_for_linearize()
+
+        if self.get_sheet_range() is not None:
+            first, last = self.get_sheet_range()
+            if first >= plan.get_sheet_count():
+                raise InvalidRangeError(self.get_sheet_range())
+            plan = plan.select_sheets(first,
+                                      min(last, plan.get_sheet_count() - 1))
+        return plan
+
+    def plan(self, conversion):
         """
-        Return the orientation of the output paper.
+        Describe a conversion without building any output page.
 
-        WARNING: in the current implementation, the orientation of the
-        output paper may be automatically adjusted, even if it was set
-        manually.
+        Only the number and the size of the input pages are needed, the
+        content of the input pages is never read.
+
+        :Parameters:
+          - `conversion` A constant from Conversion.
 
         :Returns:
-            A constant among from PageOrientation, or None (if square paper).
+            A dictionnary which can be written as JSON, containing the items
+            returned by ImpositionPlan.to_dict and:
+              - `page_count` the number of input pages;
+              - `input_size` the size of the input pages;
+              - `layout` the layout of input pages on one output page;
+              - `sheet_count` the number of output pages;
+              - `empty_slots` the number of slots left blank on output
+                pages.
+
+        :Raises MismachingOrientationsError: if the required layout is
+            incompatible with the input page orientation.
         """
-        if self.get_output_height() > self.get_output_width():
-            return PageOrientation.PORTRAIT
-        elif self.get_output_height() < self.get_output_width():
-            return PageOrientation.LANDSCAPE
-        else:
-            return None
+        plan = self.get_plan(conversion)
+        description = plan.to_dict()
+        description["page_count"] = self.get_page_count()
+        description["input_size"] = list(self.get_input_size())
+        description["layout"] = self.get_layout()
+        description["sheet_count"] = plan.get_sheet_count()
+        description["empty_slots"] = 0
+        for sheet in description["sheets"]:
+            description["empty_slots"] += sheet.count(None)
+        return description
 
     # CONVERSION FUNCTIONS
     # ====================
@@ -546,12 +2375,18 @@ class StreamConverter(AbstractConverter):
     This class performs conversions on file-like objects (e.g. a StreamIO).
     """
 
+    CANCELLATION_POLL_INTERVAL = 0.05
+    """The time between two checks of the cancellation token while waiting
+    for worker processes, in seconds"""
+
     def __init__(self,
                  input_stream, 
                  output_stream,
                  layout='2x1',
                  format='A4',
-                 copy_pages=False):
+                 copy_pages=False,
+                 placement_engine=PlacementEngine.MERGE,
+                 jobs=1):
         """
         Create a StreamConverter.
 
@@ -566,264 +2401,735 @@ class StreamConverter(AbstractConverter):
           - `copy_pages` Wether the same group of input pages shoud be copied
             to fill the corresponding output page or not (see
             set_copy_pages).
+          - `placement_engine` The way input pages are put on output pages
+            (see set_placement_engine).
+          - `jobs` The number of processes building output pages (see
+            set_jobs).
         """
 
-        AbstractConverter.__init__(self, layout, format, 
-                                   copy_pages)
+        AbstractConverter.__init__(self, layout, format,
+                                   copy_pages, placement_engine, jobs)
 
         
 
         self._output_stream = output_stream
         self._input_stream = input_stream
 
-        self._inpdf = pyPdf.PdfFileReader(input_stream)
+        self.__stats = _Stats()
+        self.__inpdf = None
+        self.__geometry = None
+        self.__compression_pool = None
+
+    def __get_inpdf(self):
+        """
+        Return the reader of the input document, which is opened the first
+        time it is needed.
+        """
+        if self.__inpdf is None:
+            start = time.time()
+            self.__inpdf = pyPdf.PdfFileReader(self._input_stream)
+            self.__stats.values["time_parse"] += time.time() - start
+        return self.__inpdf
+
+    _inpdf = property(__get_inpdf)
+
+    def get_page_geometry(self):
+        """
+        Return the boxes and rotation of the input pages, which are read the
+        first time they are needed.
+
+        :Returns:
+            A PageGeometry.
+        """
+        if self.__geometry is None:
+            inpdf = self._inpdf
+            start = self.__stats.start()
+            self.__geometry = PageGeometry(inpdf)
+            self.__stats.stop("parse", start)
+        return self.__geometry
+
+    def set_page_geometry(self, geometry):
+        """
+        Set the boxes and rotation of the input pages, when they were already
+        read, e.g. by another converter of the same document.
+
+        The number and size of the input pages are then known without
+        reading the input document, so that plans (see get_plan and plan)
+        can be computed without it.
+
+        :Parameters:
+          - `geometry` A PageGeometry of the input document.
+        """
+        assert isinstance(geometry, PageGeometry)
+        self.__geometry = geometry
+
+    def set_collect_stats(self, collect_stats):
+        """
+        Set wether to measure the conversion phases or not (see get_stats).
+
+        :Parameters:
+          - `collect_stats` True to measure the conversion phases.
+        """
+        self.__stats.enabled = bool(collect_stats)
+
+    def get_collect_stats(self):
+        """
+        Get wether the conversion phases are measured or not.
+
+        :Returns:
+            True if the conversion phases are measured.
+        """
+        return self.__stats.enabled
+
+    def get_stats(self):
+        """
+        Return the timers and counters measured since the creation of the
+        converter, while measuring was enabled (see set_collect_stats).
+
+        The phases are:
+          - `parse` reading the structure of the input document: its
+            cross-reference table, page tree and page dictionaries (the
+            time to open the input document is always measured);
+          - `merge` putting input pages on output pages, which includes
+            parsing input content streams for the PlacementEngine.MERGE
+            engine;
+          - `compress` compressing the content streams of output pages,
+            which is added up over the compression threads (see
+            set_compression_threads);
+          - `write` writing the output document, which includes reading
+            the input objects it references (fonts, images...).
+
+        When output pages are built by several processes (see set_jobs),
+        the durations measured in each process are added up.
+
+        :Returns:
+            A dictionnary containing the duration of each phase in seconds
+            (time_parse, time_merge, time_compress and time_write) and the
+            number of output pages built (sheets), input content streams
+            parsed (pages_parsed), input pages put on output pages
+            (cells_merged), compressed content stream bytes
+            (bytes_compressed) and output bytes written (bytes_written).
+        """
+        return dict(self.__stats.values)
 
     def get_input_height(self):
-        page = self._inpdf.getPage(0)
-        height = page.mediaBox.getHeight()
+        width, height = self.get_page_geometry().get_size(0)
         return int(height)
 
     def get_input_width(self):
-        page = self._inpdf.getPage(0)
-        width = page.mediaBox.getWidth()
+        width, height = self.get_page_geometry().get_size(0)
         return int(width)
 
     def get_page_count(self):
-        return self._inpdf.getNumPages()
+        if self.__geometry is not None:
+            return len(self.__geometry)
+        # The page tree is read the first time
+        start = self.__stats.start()
+        page_count = self._inpdf.getNumPages()
+        self.__stats.stop("parse", start)
+        return page_count
 
-    def __fix_page_orientation(self, cmp):
+    def __write_output_stream(self, outpdf):
         """
-        Adapt the output page orientation.
+        Writes the end of the output to the stream.
 
         :Parameters:
-          - `cmp` A comparator function. Takes: number of pages on one
-            direction (int), number of pages on the other direction
-            (int). Must return: the boolean result of the comparaison.
+          - `outpdf` the StreamingPdfWriter to finish writing to the stream.
+        """
+        self._report_progress(ProgressPhase.WRITE, 1, 1)
+        start = self.__stats.start()
+        outpdf.close()
+        self.__stats.stop("write", start)
+        self.__stats.count("bytes_written", outpdf.tell())
+        self._report_progress(ProgressPhase.DONE, 1, 1)
 
-        :Raises MismachingOrientationsError: if the required layout is
-            incompatible with the input page orientation.
+    @staticmethod
+    def __format_matrix(matrix):
         """
-        if cmp(self.get_pages_in_width(), self.get_pages_in_height()):
-            if self.get_input_orientation() == PageOrientation.PORTRAIT:
-                if self._get_output_orientation() == PageOrientation.PORTRAIT:
-                    self._set_output_orientation(PageOrientation.LANDSCAPE)
-            else:
-                raise MismachingOrientationsError(self.get_layout())
-        elif cmp(self.get_pages_in_height(), self.get_pages_in_width()):
-            if self.get_input_orientation() == PageOrientation.LANDSCAPE:
-                if self._get_output_orientation() == PageOrientation.LANDSCAPE:
-                    self._set_output_orientation(PageOrientation.PORTRAIT)
-            else:
-                raise MismachingOrientationsError(self.get_layout())
-        else:
-            if self.get_input_orientation() == PageOrientation.LANDSCAPE:
-                if self._get_output_orientation() == PageOrientation.PORTRAIT:
-                    self._set_output_orientation(PageOrientation.LANDSCAPE)
-            else:
-                if self._get_output_orientation() == PageOrientation.LANDSCAPE:
-                    self._set_output_orientation(PageOrientation.PORTRAIT)
+        Format a transformation matrix as content stream operands.
 
-    def __fix_page_orientation_for_booklet(self):
+        :Parameters:
+          - `matrix` A sequence of 6 numbers.
+
+        :Returns:
+            A string containing the 6 numbers separated by spaces.
         """
-        Adapt the output page orientation to impose
+        return " ".join([("%.5f" % value).rstrip("0").rstrip(".")
+                         for value in matrix])
+
+    @classmethod
+    def __format_box(cls, box):
         """
-        def __is_two_times(op1, op2):
-            if op1 == 2 * op2:
-                return True
-            else:
-                return False
-        self.__fix_page_orientation(__is_two_times)
+        Create a PDF rectangle.
 
-    def __fix_page_orientation_for_linearize(self):
+        :Parameters:
+          - `box` A sequence of 4 numbers.
+
+        :Returns:
+            A pyPdf.generic.ArrayObject.
         """
-        Adapt the output page orientation to linearize
+        return pyPdf.generic.ArrayObject([
+            pyPdf.generic.FloatObject(cls.__format_matrix((value,)))
+            for value in box])
+
+    def __fit_cells(self, cells, size):
         """
-        def __is_half(op1, op2):
-            if op2 == 2 * op1:
-                return True
-            else:
-                return False
-        self.__fix_page_orientation(__is_half)
+        Adapt the transformation matrices of the input pages put on an
+        output page to their own size and rotation (see
+        PageGeometry.fit_matrix).
 
-    def __get_sequence_for_booklet(self):
+        :Parameters:
+          - `cells` A list of tuples (page_number, matrix) as returned by
+            ImpositionPlan.get_cells.
+          - `size` A tuple (width, height) representing the size of the
+            input pages the plan was computed for.
+
+        :Returns:
+            A list of tuples (page_number, matrix).
         """
-        Calculates the page sequence to impose a booklet.
+        geometry = self.get_page_geometry()
+        return [(page_number, geometry.fit_matrix(page_number, matrix, size))
+                for page_number, matrix in cells]
+
+    def __encode_stream(self, data):
+        """
+        Create a stream object compressed following the compression profile
+        (see set_compression_profile).
+
+        When several compression threads are used, the data is compressed
+        in the compression pool, and only waited for when the stream is
+        written.
+
+        :Parameters:
+          - `data` The decoded data of the stream.
 
         :Returns:
-            A list of page numbers representing sequence of pages to
-            impose a booklet. The list might contain None where blank
-            pages should be added.
+            A pyPdf.generic.StreamObject.
         """
-        n_pages = self.get_page_count()
-        pages = range(0, n_pages)
+        level = _compression_levels[self.get_compression_profile()]
+        if level is None:
+            return _create_stream(data, None)
+        if self.__compression_pool:
+            return _DeferredStreamObject(self.__compression_pool.apply_async(
+                _compress, (data, level)), self.__stats)
+        data, duration = _compress(data, level)
+        self.__stats.add({"time_compress": duration,
+                          "bytes_compressed": len(data)})
+        return _create_stream(data, level)
 
-        # Check for missing pages
-        if (n_pages % 4) == 0:
-            n_missing_pages = 0
-        else:
-            n_missing_pages = 4 - (n_pages % 4)
-            # XXX: print a warning if input page number not diviable by 4?
+    def __create_form_xobject(self, page_number):
+        """
+        Wrap an input page in a Form XObject.
 
-        # Add reference to the missing empty pages to the pages sequence
-        for missing_page in range(0, n_missing_pages):
-            pages.append(None)
-
-        def append_and_copy(list, pages):
-            """
-            Append pages to the list and copy them if needed
-            """
-            if self.get_copy_pages():
-                for i in range(self.get_pages_in_sheet() / 2):
-                    list.extend(pages)
+        When the page has a single content stream, its data is reused as is,
+        without being decoded. The Form XObject is clipped to the crop box
+        of the page.
+
+        :Parameters:
+          - `page_number` The number of the input page to wrap.
+
+        :Returns:
+            A pyPdf.generic.StreamObject representing the Form XObject.
+        """
+        page = self._inpdf.getPage(page_number)
+        contents = page.getContents()
+        if contents is None:
+            xobject = pyPdf.generic.DecodedStreamObject()
+            xobject.setData("")
+        elif isinstance(contents, pyPdf.generic.ArrayObject):
+            xobject = self.__encode_stream("\n".join(
+                [stream.getObject().getData() for stream in contents]))
+        else:
+            if contents.has_key("/Filter"):
+                xobject = pyPdf.generic.EncodedStreamObject()
             else:
-                list.extend(pages)
+                xobject = pyPdf.generic.DecodedStreamObject()
+            xobject._data = contents._data
+            for key in ("/Filter", "/DecodeParms"):
+                if contents.has_key(key):
+                    xobject[pyPdf.generic.NameObject(key)] = \
+                        contents.raw_get(key)
+        xobject.update({
+            pyPdf.generic.NameObject("/Type"):
+                pyPdf.generic.NameObject("/XObject"),
+            pyPdf.generic.NameObject("/Subtype"):
+                pyPdf.generic.NameObject("/Form"),
+            pyPdf.generic.NameObject("/BBox"): self.__format_box(
+                self.get_page_geometry().get_crop_box(page_number)),
+            })
+        if page.has_key("/Resources"):
+            xobject[pyPdf.generic.NameObject("/Resources")] = \
+                page.raw_get("/Resources")
+        return xobject
+
+    def __get_page_xobject(self, outpdf, page_number):
+        """
+        Get a reference to the Form XObject wrapping an input page.
+
+        The Form XObject is added to outpdf the first time the page is
+        requested, and the same reference is returned afterwards.
 
-        # Arranges the pages in booklet order
-        sequence = []
-        while pages:
-            append_and_copy(sequence, [pages.pop(), pages.pop(0)])
-            append_and_copy(sequence, [pages.pop(0), pages.pop()])
+        :Parameters:
+          - `outpdf` The StreamingPdfWriter the XObject belongs to.
+          - `page_number` The number of the input page.
 
-        return sequence
+        :Returns:
+            A pyPdf.generic.IndirectObject referencing the XObject.
+        """
+        if page_number not in self.__page_xobjects:
+            xobject = self.__create_form_xobject(page_number)
+            self.__page_xobjects[page_number] = outpdf._addObject(xobject)
+        return self.__page_xobjects[page_number]
 
-    def __get_sequence_for_linearize(self, booklet=True):
+    def __get_clipped_xobject(self, outpdf, page_number, matrix, size):
         """
-        Calculates the page sequence to lineraize a booklet.
+        Create a Form XObject showing the part of an input page visible on
+        an output page.
+
+        The Form XObject draws the shared Form XObject wrapping the whole
+        input page (see __get_page_xobject), and its BBox clips it to the
+        part of the input page which lands on the output page, so that
+        only that part is rendered.
+
+        :Parameters:
+          - `outpdf` The StreamingPdfWriter the XObject belongs to.
+          - `page_number` The number of the input page.
+          - `matrix` The transformation matrix applied to the input page.
+          - `size` A tuple (width, height) representing the size of the
+            output page.
 
         :Returns:
-            A list of page numbers representing sequence of pages to
-            be extracted to linearize a booklet.
-        """
-        # XXX: is booklet argument useful?
+            A pyPdf.generic.IndirectObject referencing the XObject.
+        """
+        a, b, c, d, e, f = [float(value) for value in matrix]
+        determinant = a * d - b * c
+        xs = []
+        ys = []
+        for x, y in ((0, 0), (size[0], 0), (0, size[1]), size):
+            xs.append((d * (x - e) - c * (y - f)) / determinant)
+            ys.append((a * (y - f) - b * (x - e)) / determinant)
+        x0, y0, x1, y1 = self.get_page_geometry().get_crop_box(page_number)
+        bbox = (max(min(xs), x0), max(min(ys), y0),
+                min(max(xs), x1), min(max(ys), y1))
+
+        xobject = pyPdf.generic.DecodedStreamObject()
+        xobject.setData("/Pg Do")
+        xobject.update({
+            pyPdf.generic.NameObject("/Type"):
+                pyPdf.generic.NameObject("/XObject"),
+            pyPdf.generic.NameObject("/Subtype"):
+                pyPdf.generic.NameObject("/Form"),
+            pyPdf.generic.NameObject("/BBox"): self.__format_box(bbox),
+            pyPdf.generic.NameObject("/Resources"):
+                pyPdf.generic.DictionaryObject({
+                    pyPdf.generic.NameObject("/XObject"):
+                        pyPdf.generic.DictionaryObject({
+                            pyPdf.generic.NameObject("/Pg"):
+                                self.__get_page_xobject(outpdf, page_number)
+                            })
+                    }),
+            })
+        return outpdf._addObject(xobject)
+
+    def __get_shared_stream(self, outpdf, data):
+        """
+        Get a reference to a small content stream shared by output pages.
 
-        def append_and_remove_copies(list, pages):
-            sequence.extend(pages)
-            if self.get_copy_pages():
-                for copy in range(self.get_pages_in_sheet() - len(pages)):
-                    sequence.append(None)
-
-        if booklet:
-            sequence = []
-            try :
-                for i in range(0, self.get_page_count() *
-                               self.get_pages_in_sheet(), 4):
-                    append_and_remove_copies(sequence, [i / 2, i / 2])
-                    append_and_remove_copies(sequence, [i / 2 + 1, i / 2 + 2])
-            except IndexError :
-                # XXX: Print a warning
-                pass
-        else:
-            sequence = range(0, self.get_page_count() * self.get_pages_in_sheet())
-        return sequence
+        :Parameters:
+          - `outpdf` The StreamingPdfWriter the stream belongs to.
+          - `data` The content of the stream.
 
-    def __get_sequence_for_reduce(self):
+        :Returns:
+            A pyPdf.generic.IndirectObject referencing the stream.
         """
-        Calculates the page sequence to linearly impose reduced pages.
+        if data not in self.__shared_streams:
+            stream = pyPdf.generic.DecodedStreamObject()
+            stream.setData(data)
+            self.__shared_streams[data] = outpdf._addObject(stream)
+        return self.__shared_streams[data]
+
+    @staticmethod
+    def __merge_resources(resources, page2_resources):
+        """
+        Add the resources of an input page to the ones of an output page.
+
+        When a resource name is already used by the output page for another
+        resource, the resource of the input page is added under a new name.
+
+        :Parameters:
+          - `resources` The resource dictionary of the output page.
+          - `page2_resources` The resource dictionary of the input page.
 
         :Returns:
-            A list of page numbers representing sequence of pages to
-            impose reduced pages. The list might contain None where blank
-            pages should be added.
+            A dictionary mapping the resource names of the input page which
+            have to be renamed to their new name.
+        """
+        rename = {}
+        for category in ("/ExtGState", "/Font", "/XObject", "/ColorSpace",
+                         "/Pattern", "/Shading", "/Properties"):
+            if not page2_resources.has_key(category):
+                continue
+            if not resources.has_key(category):
+                resources[pyPdf.generic.NameObject(category)] = \
+                    pyPdf.generic.DictionaryObject()
+            elif not isinstance(resources.raw_get(category),
+                                pyPdf.generic.DictionaryObject):
+                # Do not modify a dictionary shared with an input page
+                resources[pyPdf.generic.NameObject(category)] = \
+                    pyPdf.generic.DictionaryObject(
+                        resources[category].getObject())
+            category_resources = resources[category]
+            page2_category_resources = page2_resources[category].getObject()
+            for name in page2_category_resources.keys():
+                newname = name
+                while category_resources.has_key(newname) and \
+                        category_resources.raw_get(newname) != \
+                        page2_category_resources.raw_get(name):
+                    newname = pyPdf.generic.NameObject(newname + "renamed")
+                if newname != name:
+                    rename[name] = newname
+                if not category_resources.has_key(newname):
+                    category_resources[newname] = \
+                        page2_category_resources.raw_get(name)
+
+        if page2_resources.has_key("/ProcSet"):
+            procset = resources.get("/ProcSet",
+                                    pyPdf.generic.ArrayObject()).getObject()
+            resources[pyPdf.generic.NameObject("/ProcSet")] = \
+                pyPdf.generic.ArrayObject(procset + [
+                    proc for proc in page2_resources["/ProcSet"].getObject()
+                    if proc not in procset])
+        return rename
+
+    def __fast_merge_page(self, outpdf, page, page2, matrix):
+        """
+        Merge an input page on an output page without parsing its content.
+
+        The content streams of the input page are referenced from the output
+        page between a stream saving the graphics state and setting the
+        transformation matrix, and a stream restoring the graphics state.
+        Only if some of its resource names clash with the ones of the output
+        page, the content of the input page is parsed to rename them.
+
+        :Parameters:
+          - `outpdf` The StreamingPdfWriter the output page belongs to.
+          - `page` The output pyPdf.pdf.PageObject.
+          - `page2` The input pyPdf.pdf.PageObject.
+          - `matrix` The transformation matrix to apply to the input page.
         """
-        if self.get_copy_pages():
-            sequence = []
-            for page in range(self.get_page_count()):
-                for copy in range(self.get_pages_in_sheet()):
-                    sequence.append(page)
+        if page2.has_key("/Resources"):
+            page2_resources = page2["/Resources"].getObject()
         else:
-            sequence = range(self.get_page_count())
-            if len(sequence) % self.get_pages_in_sheet() != 0:
-                for missing_page in range(self.get_pages_in_sheet() -
-                        (len(sequence) % self.get_pages_in_sheet())):
-                    sequence.append(None)
-        return sequence
+            page2_resources = pyPdf.generic.DictionaryObject()
+        rename = self.__merge_resources(page["/Resources"].getObject(),
+                                        page2_resources)
+        if not page2.has_key("/Contents"):
+            return
+
+        if page.has_key("/Contents"):
+            contents = page.raw_get("/Contents")
+        else:
+            contents = pyPdf.generic.ArrayObject()
+        contents.append(self.__get_shared_stream(outpdf, "q %s cm\n" %
+            self.__format_matrix(matrix)))
+        if rename:
+            page2_contents = pyPdf.pdf.ContentStream(page2.getContents(),
+                                                     page2.pdf)
+            for operands, operator in page2_contents.operations:
+                if operator == "INLINE IMAGE":
+                    continue
+                for i in range(len(operands)):
+                    if isinstance(operands[i], pyPdf.generic.NameObject):
+                        operands[i] = rename.get(operands[i], operands[i])
+            page2_contents = self.__encode_stream(page2_contents.getData())
+            self.__stats.count("pages_parsed")
+            contents.append(page2_contents)
+        elif isinstance(page2.raw_get("/Contents"),
+                        pyPdf.generic.ArrayObject):
+            contents.extend(page2.raw_get("/Contents"))
+        else:
+            contents.append(page2.raw_get("/Contents"))
+        contents.append(self.__get_shared_stream(outpdf, "\nQ\n"))
+        page[pyPdf.generic.NameObject("/Contents")] = contents
 
-    def __write_output_stream(self, outpdf):
+    def __place_page(self, outpdf, page, operations, page_number, matrix,
+                     engine, clip_size=None):
+        """
+        Put an input page on an output page.
+
+        :Parameters:
+          - `outpdf` The StreamingPdfWriter the output page belongs to.
+          - `page` The output pyPdf.pdf.PageObject.
+          - `operations` A list collecting the content stream operations
+            of the output page, used by the XObject placement engine.
+          - `page_number` The number of the input page to put.
+          - `matrix` The transformation matrix to apply to the input page.
+          - `engine` The placement engine to use, a constant from
+            PlacementEngine.
+          - `clip_size` With the XObject placement engine, the size of the
+            output page to clip the input page to (see
+            __get_clipped_xobject), or None not to clip it.
+        """
+        start = self.__stats.start()
+        if engine == PlacementEngine.XOBJECT:
+            resources = page["/Resources"].getObject()
+            if not resources.has_key("/XObject"):
+                resources[pyPdf.generic.NameObject("/XObject")] = \
+                    pyPdf.generic.DictionaryObject()
+            if clip_size:
+                name = pyPdf.generic.NameObject("/Pg%iC%i" % (
+                    page_number, len(resources["/XObject"])))
+                resources["/XObject"][name] = self.__get_clipped_xobject(
+                    outpdf, page_number, matrix, clip_size)
+            else:
+                name = pyPdf.generic.NameObject("/Pg%i" % page_number)
+                resources["/XObject"][name] = \
+                    self.__get_page_xobject(outpdf, page_number)
+            operations.append("q %s cm %s Do Q" % (
+                self.__format_matrix(matrix), name))
+        else:
+            page2 = self._inpdf.getPage(page_number)
+            start = self.__stats.stop("parse", start)
+            if engine == PlacementEngine.FAST_MERGE:
+                self.__fast_merge_page(outpdf, page, page2, matrix)
+            else:
+                # pyPdf parses the content stream of page2 for each merge
+                page.mergeTransformedPage(page2, matrix)
+                self.__stats.count("pages_parsed")
+        self.__stats.stop("merge", start)
+        self.__stats.count("cells_merged")
+
+    def __finish_page(self, page, operations, engine):
         """
-        Writes output to the stream.
+        Compress the content of an output page once all pages were put on it.
 
         :Parameters:
-          - `outpdf` the object to write to the stream. This object must have a
-            write() method.
+          - `page` The output pyPdf.pdf.PageObject.
+          - `operations` The list of content stream operations filled by
+            __place_page.
+          - `engine` The placement engine used, a constant from
+            PlacementEngine.
         """
-        self.get_progress_callback()(_("writing converted file"), 1)
-        outpdf.write(self._output_stream)
-        self.get_progress_callback()(_("done"), 1)
+        if engine == PlacementEngine.FAST_MERGE:
+            # The referenced input streams are kept as they are
+            return
+        if engine == PlacementEngine.XOBJECT:
+            page[pyPdf.generic.NameObject("/Contents")] = \
+                self.__encode_stream("\n".join(operations))
+        elif page.has_key("/Contents"):
+            page[pyPdf.generic.NameObject("/Contents")] = \
+                self.__encode_stream(page.getContents().getData())
 
-    def __do_reduce(self, sequence):
+    def __merge_sheets(self, plan):
         """
-        Do actual imposition job.
+        Build output pages with the PlacementEngine.MERGE placement engine.
+
+        The output pages are built in worker processes if more than one job
+        is allowed (see set_jobs), in this process otherwise.
+
+        :Parameters:
+          - `plan` The ImpositionPlan to follow.
+
+        :Returns:
+            An iterator over tuples (contents, resources, stats) for each
+            output page, in order, where contents is the content stream of
+            the output page, or None if it is blank, and resources and
+            stats are as returned by _merge_sheet.
+        """
+        width, height = plan.get_output_size()
+        input_size = self.get_page_geometry().get_size(0)
+        collect_stats = self.get_collect_stats()
+        level = _compression_levels[self.get_compression_profile()]
+
+        if self.get_jobs() == 1:
+            # The content streams are compressed by __encode_stream, which
+            # may use the compression pool
+            for sheet in xrange(plan.get_sheet_count()):
+                contents, resources, stats = _merge_sheet(self._inpdf,
+                    (width, height,
+                     self.__fit_cells(plan.get_cells(sheet), input_size),
+                     collect_stats, None), self.get_cancellation_token())
+                if contents is not None:
+                    contents = self.__encode_stream(contents)
+                yield contents, resources, stats
+            return
+
+        sheets = ((width, height,
+                   self.__fit_cells(plan.get_cells(sheet), input_size),
+                   collect_stats, level)
+                  for sheet in xrange(plan.get_sheet_count()))
+
+        if isinstance(self._input_stream, mmap.mmap) and hasattr(os, "fork"):
+            # Forked workers share the mapping instead of a copy of the
+            # whole document
+            input_data = self._input_stream
+        else:
+            self._input_stream.seek(0)
+            input_data = self._input_stream.read()
+        cancellation_token = self.get_cancellation_token()
+        pool = multiprocessing.Pool(self.get_jobs(), _init_merge_worker,
+                                    (input_data,))
+        try:
+            # Sheets are sent one at a time, and the results are waited for
+            # with a timeout, so that a cancellation terminates the workers
+            # without waiting for the sheets being built
+            results = pool.imap(_merge_worker_sheet, sheets, 1)
+            for sheet in xrange(plan.get_sheet_count()):
+                while True:
+                    cancellation_token.check()
+                    try:
+                        contents, resources, stats = results.next(
+                            self.CANCELLATION_POLL_INTERVAL)
+                        break
+                    except multiprocessing.TimeoutError:
+                        pass
+                if contents is not None:
+                    contents = _create_stream(contents, level)
+                yield contents, resources, stats
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def impose(self, plan):
+        """
+        Build the output pages following a plan and write them to the
+        output stream.
+
+        If the conversion is cancelled (see set_cancellation_token), what
+        was written to the output stream is removed if the stream can be
+        truncated.
 
         :Parameters:
-          - `sequence` a list of page numbers repersenting the sequence of
-            pages to impose. None means blank page.
+          - `plan` An ImpositionPlan (see get_plan).
 
+        :Raises UserInterruptError: if the conversion was cancelled.
         """
-        # XXX: Translated progress messages
-        self.__fix_page_orientation_for_booklet()
-        outpdf = pyPdf.PdfFileWriter()
-
-        current_page = 0
-        while current_page < len(sequence):
-            self.get_progress_callback()(
-                _("creating page %i") %
-                    ((current_page + self.get_pages_in_sheet()) /
-                        self.get_pages_in_sheet()),
-                float(current_page) / len(sequence)
-                )
-            page = outpdf.addBlankPage(self.get_output_width(), 
-                self.get_output_height())
-            for vert_pos in range(0, self.get_pages_in_height()):
-                for horiz_pos in range(0, self.get_pages_in_width()):
-                    if current_page < len(sequence) and sequence[current_page] is not None:
-                        page.mergeScaledTranslatedPage(
-                            self._inpdf.getPage(sequence[current_page]),
-                            self.get_reduction_factor(), 
-                            horiz_pos*self.get_output_width() / \
-                                self.get_pages_in_width(),
-                            self.get_output_height() - ( 
-                                (vert_pos + 1) * self.get_output_height() / \
-                                self.get_pages_in_height())
-                            )
-                    current_page += 1
-            page.compressContentStreams()
-        self.__write_output_stream(outpdf)
+        self._start_progress()
+        cancellation_token = self.get_cancellation_token()
+        cancellation_token.check()
+        if plan.get_conversion() == Conversion.LINEARIZE:
+            phase = ProgressPhase.EXTRACT
+        else:
+            phase = ProgressPhase.CREATE
+        width, height = plan.get_output_size()
+
+        engine = self.get_placement_engine()
+        clip_size = None
+        if plan.get_conversion() == Conversion.LINEARIZE:
+            # Each output page only shows a part of an input page: the
+            # input page is stored once and each output page draws it
+            # clipped to its own part
+            engine = PlacementEngine.XOBJECT
+            clip_size = (width, height)
+
+        try:
+            position = self._output_stream.tell()
+        except (AttributeError, IOError):
+            position = None
+
+        outpdf = StreamingPdfWriter(self._output_stream, cancellation_token)
+        self.__page_xobjects = {}
+        self.__shared_streams = {}
+        self.__compression_pool = None
+        if self.get_compression_profile() != CompressionProfile.NONE and \
+                self.get_compression_threads() > 1 and \
+                (engine != PlacementEngine.MERGE or self.get_jobs() == 1):
+            self.__compression_pool = multiprocessing.pool.ThreadPool(
+                self.get_compression_threads())
+            # Output pages are written a few pages later, so that they are
+            # compressed while the next ones are built
+            lag = self.get_compression_threads()
+        else:
+            lag = 0
+        sheet_ends = collections.deque()
+        # Input pages whose size or rotation differ from the first one are
+        # fitted in their slots
+        input_size = self.get_page_geometry().get_size(0)
+        if engine == PlacementEngine.MERGE:
+            merged_sheets = self.__merge_sheets(plan)
+
+        try:
+            for sheet in xrange(plan.get_sheet_count()):
+                cancellation_token.check()
+                self._report_progress(phase, sheet, plan.get_sheet_count())
+                page = outpdf.addBlankPage(width, height)
+                if engine == PlacementEngine.MERGE:
+                    contents, resources, stats = merged_sheets.next()
+                    self.__stats.add(stats)
+                    page[pyPdf.generic.NameObject("/Resources")] = \
+                        pyPdf.generic.readObject(StringIO(resources),
+                                                 self._inpdf)
+                    if contents is not None:
+                        page[pyPdf.generic.NameObject("/Contents")] = \
+                            contents
+                else:
+                    operations = []
+                    for page_number, matrix in self.__fit_cells(
+                            plan.get_cells(sheet), input_size):
+                        cancellation_token.check()
+                        self.__place_page(outpdf, page, operations,
+                                          page_number, matrix, engine,
+                                          clip_size)
+                    cancellation_token.check()
+                    self.__finish_page(page, operations, engine)
+                # The objects are numbered at once, so that the output does
+                # not depend on how late they are written
+                start = self.__stats.start()
+                sheet_ends.append(len(outpdf._objects))
+                outpdf.sweep(sheet_ends[-1])
+                # The input objects of the sheet were copied by the sweep
+                _release_objects(self._inpdf)
+                if len(sheet_ends) > lag:
+                    outpdf.flush(sheet_ends.popleft())
+                    self.__stats.stop("write", start)
+                self.__stats.count("sheets")
+            self.__write_output_stream(outpdf)
+        except UserInterruptError:
+            self.__discard_output(position)
+            raise
+        finally:
+            if engine == PlacementEngine.MERGE:
+                merged_sheets.close()
+            if self.__compression_pool:
+                self.__compression_pool.terminate()
+                self.__compression_pool.join()
+                self.__compression_pool = None
+
+    def __discard_output(self, position):
+        """
+        Remove what an interrupted conversion wrote to the output stream,
+        if the stream supports it.
+
+        :Parameters:
+          - `position` The position of the output stream when the conversion
+            started, or None if it is unknown.
+        """
+        if position is None:
+            return
+        try:
+            self._output_stream.seek(position)
+            self._output_stream.truncate()
+        except (AttributeError, IOError):
+            pass
+
+    def convert(self, conversion):
+        """
+        Perform a conversion.
+
+        :Parameters:
+          - `conversion` A constant from Conversion.
+        """
+        self.impose(self.get_plan(conversion))
 
     def bookletize(self):
-        self.__do_reduce(self.__get_sequence_for_booklet())
+        self.convert(Conversion.BOOKLETIZE)
 
     def reduce(self):
-        self.__do_reduce(self.__get_sequence_for_reduce())
+        self.convert(Conversion.REDUCE)
 
     def linearize(self, booklet=True):
-        # XXX: Translated progress messages
         # XXX: Wrong zoom factor e.g. when layout is 2x1
-
-        self.__fix_page_orientation_for_linearize()
-        sequence = self.__get_sequence_for_linearize()
-        outpdf = pyPdf.PdfFileWriter()
-
-        output_page = 0
-        for input_page in range(0, self.get_page_count()):
-            for vert_pos in range(0, self.get_pages_in_height()):
-                for horiz_pos in range(0, self.get_pages_in_width()):
-                    if sequence[output_page] is not None:
-                        self.get_progress_callback()(
-                            _("extracting page %i") % (output_page + 1),
-                            float(output_page) / len(sequence))
-                        page = outpdf.insertBlankPage(self.get_output_width(),
-                                                      self.get_output_height(),
-                                                      sequence[output_page])
-                        page.mergeScaledTranslatedPage(
-                            self._inpdf.getPage(input_page),
-                            self.get_increasing_factor(),
-                            - horiz_pos * self.get_output_width(),
-                            (vert_pos - self.get_pages_in_height() + 1) * \
-                                self.get_output_height()
-                            )
-                        page.compressContentStreams()
-                    output_page += 1
-        self.__write_output_stream(outpdf)
+        self.convert(Conversion.LINEARIZE)
 
 ########################################################################
 
@@ -837,7 +3143,10 @@ class FileConverter(StreamConverter):
                  layout='2x1',
                  format='A4',
                  copy_pages=False,
-                 overwrite_outfile_callback=None):
+                 overwrite_outfile_callback=None,
+                 placement_engine=PlacementEngine.MERGE,
+                 jobs=1,
+                 map_input=False):
         """
         Create a FileConverter.
 
@@ -857,12 +3166,23 @@ class FileConverter(StreamConverter):
             signature must be : take a string for the outfile_name as an argument;
             return False not to overwrite the file. If ommited, existing file
             would be overwritten without confirmation.
+          - `placement_engine` The way input pages are put on output pages
+            (see set_placement_engine).
+          - `jobs` The number of processes building output pages (see
+            set_jobs).
+          - `map_input` Wether to map the input file in memory (mmap)
+            instead of reading it through a file object. This saves
+            system calls, which may be expensive e.g. on network
+            filesystems, and the copy of the whole input file otherwise
+            given to worker processes (see set_jobs). Files which can not
+            be mapped are read normally.
 
         """
         # sets [input, output]_stream to None so we can test their presence
         # in __del__
         self._input_stream = None
         self._output_stream = None
+        self.__cache = None
 
         # outfile_name is set if provided
         if outfile_name:
@@ -880,29 +3200,180 @@ class FileConverter(StreamConverter):
         else:
             overwrite_outfile_callback = lambda filename: True
 
-        # Now initialize a streamConverter
-        self._input_stream = open(self.get_infile_name(), 'rb')
+        # Now initialize a streamConverter. The output file is only opened
+        # when the conversion starts, so that plan() does not create it.
+        self._input_stream = self.__open_input(self.get_infile_name(),
+                                               map_input)
         outfile_name = self.get_outfile_name()
         if (os.path.exists(outfile_name) and not
                 overwrite_outfile_callback(os.path.abspath(outfile_name))):
             raise UserInterruptError()
-        self._output_stream = open(outfile_name, 'wb')
-        StreamConverter.__init__(self, self._input_stream, self._output_stream,
-                                 layout, format, copy_pages)
+        StreamConverter.__init__(self, self._input_stream, None,
+                                 layout, format, copy_pages, placement_engine,
+                                 jobs)
 
-    def __del__(self):
-        if self._input_stream:
-            try:
-                self._input_stream.close()
-            except IOError:
-                # XXX: Do something better
-                pass
-        if self._output_stream:
-            try:
+    OUTPUT_BUFFER_SIZE = 1024 * 1024
+    """The size of the buffer of the output file, in bytes"""
+
+    @staticmethod
+    def __open_input(infile_name, map_input):
+        """
+        Open the input file.
+
+        :Parameters:
+          - `infile_name` The name of the input PDF file.
+          - `map_input` Wether to map the file in memory if possible.
+
+        :Returns:
+            A file object, or a read-only mmap of the file.
+        """
+        input_file = open(infile_name, 'rb')
+        if not map_input:
+            return input_file
+        try:
+            # The mapping remains valid once the file is closed
+            input_map = mmap.mmap(input_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # e.g. empty files, pipes, or files larger than the address
+            # space
+            return input_file
+        input_file.close()
+        return input_map
+
+    def convert(self, conversion):
+        """
+        Perform a conversion.
+
+        If a result cache is set (see set_cache) and holds the result of
+        the same conversion of the same document, this result is copied to
+        the output file without reading the input document further.
+        Otherwise the result of the conversion is stored in the cache.
+
+        :Parameters:
+          - `conversion` A constant from Conversion.
+        """
+        cache = self.get_cache()
+        if not cache:
+            return StreamConverter.convert(self, conversion)
+
+        key = cache.get_key(self._input_stream, {
+            "conversion": conversion,
+            "layout": (self.get_pages_in_width(),
+                       self.get_pages_in_height()),
+            "output_size": (self.get_output_width(),
+                            self.get_output_height()),
+            "copy_pages": self.get_copy_pages(),
+            "placement_engine": self.get_placement_engine(),
+            "compression_profile": self.get_compression_profile(),
+            "page_range": self.get_page_range(),
+            "sheet_range": self.get_sheet_range(),
+            })
+        result = cache.open(key)
+        if not result:
+            StreamConverter.convert(self, conversion)
+            cache.store(key, self.get_outfile_name())
+            return
+
+        self._start_progress()
+        try:
+            self.get_cancellation_token().check()
+            self.__write_output_file(lambda: shutil.copyfileobj(
+                result, self._output_stream, self.OUTPUT_BUFFER_SIZE))
+        finally:
+            result.close()
+        self._report_progress(ProgressPhase.DONE, 1, 1)
+
+    def impose(self, plan):
+        """
+        Build the output pages following a plan and write them to the
+        output file.
+
+        The output is written to a temporary file in the directory of the
+        output file, which is renamed to the output file name once the
+        conversion succeeded: an existing output file is left untouched
+        and no partial output file is ever visible.
+
+        :Parameters:
+          - `plan` An ImpositionPlan (see get_plan).
+
+        :Raises UserInterruptError: if the conversion was cancelled.
+        """
+        self.__write_output_file(lambda: StreamConverter.impose(self, plan))
+
+    def __write_output_file(self, write):
+        """
+        Write the output file through a temporary file.
+
+        :Parameters:
+          - `write` A function writing the output to self._output_stream.
+        """
+        outfile_name = self.get_outfile_name()
+        self.__open_temporary_output(outfile_name)
+        try:
+            write()
+            self._output_stream.close()
+            self._output_stream = None
+            _replace_file(self.__temporary_name, outfile_name)
+        except:
+            # Do not leave a partial output file
+            if self._output_stream:
                 self._output_stream.close()
-            except IOError:
-                # XXX: Do something better
-                pass
+                self._output_stream = None
+            os.remove(self.__temporary_name)
+            raise
+
+    def __open_temporary_output(self, outfile_name):
+        """
+        Open a temporary file next to the output file as the output
+        stream, with the permissions the output file would get.
+
+        :Parameters:
+          - `outfile_name` The name of the output file.
+        """
+        directory, name = os.path.split(os.path.abspath(outfile_name))
+        descriptor, self.__temporary_name = tempfile.mkstemp(
+            ".tmp", "." + name + ".", directory)
+        if os.path.exists(outfile_name):
+            mode = os.stat(outfile_name).st_mode & 0777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0666 & ~umask
+        try:
+            os.chmod(self.__temporary_name, mode)
+        except OSError:
+            pass
+        self._output_stream = os.fdopen(descriptor, 'wb',
+                                        self.OUTPUT_BUFFER_SIZE)
+
+    def close(self):
+        """
+        Close the input and output files.
+
+        The converter can not be used anymore afterwards. Converters are
+        also context managers which are closed when leaving the with
+        block.
+        """
+        for stream in (self._input_stream, self._output_stream):
+            if stream:
+                try:
+                    stream.close()
+                except IOError:
+                    # XXX: Do something better
+                    pass
+        self._input_stream = None
+        self._output_stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __del__(self):
+        self.close()
 
 
     # GETTERS AND SETTERS SECTION
@@ -952,6 +3423,25 @@ class FileConverter(StreamConverter):
         """
         return self.__outfile_name
 
+    def set_cache(self, cache):
+        """
+        Set the cache of conversion results (see convert).
+
+        :Parameters:
+          - `cache` A ResultCache, or None not to use any cache.
+        """
+        assert cache is None or isinstance(cache, ResultCache)
+        self.__cache = cache
+
+    def get_cache(self):
+        """
+        Get the cache of conversion results.
+
+        :Returns:
+            A ResultCache, or None.
+        """
+        return self.__cache
+
 
 # Convenience functions
 # =====================